@@ -7,7 +7,7 @@ Membuat dan mengkonfigurasi aplikasi Flask menggunakan Application Factory patte
 import os
 from flask import Flask
 from app.config import Config
-from app.extensions import db, migrate
+from app.extensions import db, migrate, compress
 
 
 def create_app(config_class=Config):
@@ -23,16 +23,30 @@ def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
 
-    # Pastikan folder upload tersedia
+    # Pastikan folder upload dan folder model liveness tersedia
     os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
+    os.makedirs(os.path.dirname(app.config["LIVENESS_MODEL_PATH"]), exist_ok=True)
 
     # Inisialisasi ekstensi
     db.init_app(app)
     migrate.init_app(app, db)
+    compress.init_app(app)
 
     # Import models agar dikenali oleh SQLAlchemy
     from app.models import biometric  # noqa: F401
 
+    # Muat model embedding wajah dan konfigurasi service sekali per worker
+    from app.services._kernels import init_kernels
+    from app.services.face_service import init_face_session
+    from app.services.palm_service import init_palm_service
+    init_kernels(app)
+    init_face_session(app)
+    init_palm_service(app)
+
+    # Siapkan API key untuk validasi header x-api-key
+    from app.utils.auth import init_api_key
+    init_api_key(app)
+
     # Register blueprints
     from app.api import register_blueprints
     register_blueprints(app)
@@ -44,5 +58,7 @@ def create_app(config_class=Config):
     # Buat tabel database jika belum ada
     with app.app_context():
         db.create_all()
+        from app.services.embedding_cache import init_generations
+        init_generations()
 
     return app
@@ -11,12 +11,19 @@ Routes:
     GET    /api/v1/biometric/<id>       - Mendapatkan detail data biometrik
 """
 
+import io
 import os
+import hashlib
 import uuid
+import shutil
 import logging
+import threading
+from collections import OrderedDict
 import cv2
 import numpy as np
+from PIL import Image
 from flask import Blueprint, request, current_app
+from sqlalchemy import func
 from werkzeug.utils import secure_filename
 
 from app.extensions import db
@@ -25,8 +32,12 @@ from app.services.face_service import (
     extract_face_embedding,
     compare_face_embeddings,
     serialize_embedding,
+    normalize_embedding,
+    find_best_face_match,
+    face_threshold,
 )
 from app.services.liveness_service import check_liveness
+from app.services import embedding_cache, vector_search
 
 from app.services.palm_service import (
     extract_palm_features,
@@ -38,6 +49,7 @@ from app.utils.responses import (
     error_response,
     not_found_response,
     created_response,
+    not_modified_response,
 )
 from app.utils.auth import require_api_key
 
@@ -51,6 +63,26 @@ bp = Blueprint("biometric", __name__, url_prefix="/api/v1/biometric")
 
 ALLOWED_TYPES = {"face", "palm"}
 
+# Kelonggaran threshold untuk kandidat ANN sebelum diverifikasi dengan jarak exact
+_ANN_THRESHOLD_SLACK = 1.1
+
+# Flask-Compress menambahkan ":<algoritma>" ke ETag response yang dikompres
+_COMPRESSED_ETAG_SUFFIXES = ("gzip", "br", "zstd", "deflate")
+
+# Upload kecil dibaca sekaligus, upload besar dibaca per potongan 1MB
+_STREAM_CHUNK_SIZE = 1 << 20
+
+# Header gambar dibaca dari potongan awal buffer saja; jika header lebih panjang
+# (misal EXIF/ICC besar), format tidak terbaca dan decode memakai flag biasa
+_IMAGE_HEADER_PEEK_SIZE = 64 << 10
+
+# Flag decode JPEG dengan skala DCT (1/8, 1/4, 1/2), dari reduksi terbesar
+_REDUCED_DECODE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
 
 def _allowed_file(filename: str) -> bool:
     """Memeriksa apakah ekstensi file diperbolehkan."""
@@ -60,30 +92,176 @@ def _allowed_file(filename: str) -> bool:
     return "." in filename and filename.rsplit(".", 1)[1].lower() in allowed
 
 
+class _ResizePool(threading.local):
+    """
+    Buffer output cv2.resize per thread, dipakai ulang antar request dengan
+    ukuran yang sama agar tidak mengalokasikan array baru setiap resize.
+
+    Hasil resize hanya valid sampai resize berikutnya dengan ukuran yang sama
+    di thread yang sama, jadi jangan disimpan melewati satu request.
+    """
+
+    MAX_BUFFERS = 8
+
+    def __init__(self):
+        self.buffers = OrderedDict()
+
+    def get(self, shape: tuple, dtype) -> np.ndarray:
+        key = (shape, np.dtype(dtype).str)
+        buf = self.buffers.pop(key, None)
+        if buf is None:
+            buf = np.empty(shape, dtype=dtype)
+            if len(self.buffers) >= self.MAX_BUFFERS:
+                self.buffers.popitem(last=False)
+        self.buffers[key] = buf
+        return buf
+
+
+_resize_pool = _ResizePool()
+
+
 def _resize_image(img: np.ndarray, max_dim: int = 640) -> np.ndarray:
     """Resize gambar agar sisi terpanjang maksimal max_dim pixel untuk kecepatan."""
     h, w = img.shape[:2]
-    if w > max_dim or h > max_dim:
-        ratio = min(max_dim / w, max_dim / h)
-        new_w, new_h = int(w * ratio), int(h * ratio)
-        img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_AREA)
+    longest = max(h, w)
+    if longest <= max_dim:
+        return img
+
+    ratio = max_dim / longest
+    new_w, new_h = int(w * ratio), int(h * ratio)
+    dst = _resize_pool.get((new_h, new_w) + img.shape[2:], img.dtype)
+    # INTER_AREA hanya perlu untuk downscale > 2x, selebihnya INTER_LINEAR lebih cepat
+    interpolation = cv2.INTER_AREA if ratio < 0.5 else cv2.INTER_LINEAR
+    return cv2.resize(img, (new_w, new_h), dst=dst, interpolation=interpolation)
+
+
+def _image_header(source) -> tuple[str | None, int]:
+    """
+    Membaca format dan sisi terpanjang gambar dari header saja (tanpa decode pixel).
+
+    Args:
+        source: Path file atau file-like object.
+
+    Returns:
+        tuple: (format Pillow atau None, sisi terpanjang atau 0 jika tidak terbaca)
+    """
+    try:
+        with Image.open(source) as header:
+            return header.format, max(header.size)
+    except Exception:
+        return None, 0
+
+
+def _decode_flags(image_format: str | None, longest: int, max_dim: int) -> int:
+    """
+    Memilih flag decode: JPEG besar di-decode langsung pada skala 1/2, 1/4,
+    atau 1/8 selama sisi terpanjangnya tetap >= max_dim, sehingga
+    upsampling resolusi penuh tidak pernah dilakukan.
+    """
+    if image_format != "JPEG":
+        return cv2.IMREAD_COLOR
+
+    for factor, flag in _REDUCED_DECODE_FLAGS:
+        if longest // factor >= max_dim:
+            return flag
+    return cv2.IMREAD_COLOR
+
+
+def _remaining_size(stream) -> int | None:
+    """Sisa ukuran stream yang bisa di-seek, atau None jika tidak diketahui."""
+    try:
+        pos = stream.tell()
+        end = stream.seek(0, os.SEEK_END)
+        stream.seek(pos)
+    except (AttributeError, OSError, ValueError):
+        return None
+    return end - pos
+
+
+def _read_stream(stream) -> bytes | bytearray:
+    """
+    Membaca isi stream upload langsung ke satu buffer tanpa salinan tambahan.
+
+    Werkzeug menampung file upload di stream yang bisa di-seek, sehingga ukuran
+    file sebenarnya diketahui dan bytearray dialokasikan tepat sekali lalu diisi
+    per potongan. Upload kecil (atau stream tanpa seek) dibaca dengan satu read().
+    """
+    size = _remaining_size(stream)
+    if size is None or size <= _STREAM_CHUNK_SIZE:
+        return stream.read()
+
+    buf = bytearray(size)
+    filled = 0
+    with memoryview(buf) as view:
+        while filled < size:
+            n = stream.readinto(view[filled:filled + _STREAM_CHUNK_SIZE])
+            if not n:
+                break
+            filled += n
+    del buf[filled:]
+    return buf
+
+
+def _imdecode_stream(stream, max_dim: int = 640) -> np.ndarray | None:
+    """
+    Decode gambar langsung dari stream upload lalu resize ke max_dim.
+
+    Returns:
+        np.ndarray: Gambar BGR, atau None jika bukan gambar valid.
+    """
+    data = _read_stream(stream)
+    if not data:
+        return None
+    flags = _decode_flags(*_image_header(io.BytesIO(data[:_IMAGE_HEADER_PEEK_SIZE])), max_dim)
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), flags)
+    if img is None:
+        return None
+    return _resize_image(img, max_dim=max_dim)
+
+
+def _save_raw(file, filepath: str):
+    """Menyalin stream upload ke disk per potongan 1MB tanpa membuat salinan penuh di memori."""
+    with open(filepath, "wb") as dst:
+        shutil.copyfileobj(file.stream, dst, _STREAM_CHUNK_SIZE)
+
+
+def _decode_and_resize_on_disk(filepath: str, max_dim: int = 640) -> np.ndarray | None:
+    """
+    Membaca gambar yang sudah tersimpan sekali, lalu menimpanya dengan versi
+    ter-resize jika sisi terpanjangnya melebihi max_dim.
+
+    Returns:
+        np.ndarray: Gambar BGR ter-resize, atau None jika bukan gambar valid.
+    """
+    image_format, longest = _image_header(filepath)
+    img = cv2.imread(filepath, _decode_flags(image_format, longest, max_dim))
+    if img is None:
+        return None
+
+    # Gambar kecil tidak perlu di-resize dan ditulis ulang
+    if max(img.shape[:2]) <= max_dim and longest <= max_dim:
+        return img
+
+    img = _resize_image(img, max_dim=max_dim)
+    cv2.imwrite(filepath, img)
     return img
 
 
-def _save_uploaded_file(file, biometric_type: str) -> str | None:
+def _save_uploaded_file(file, biometric_type: str) -> tuple[str | None, np.ndarray | None]:
     """
     Menyimpan file yang diupload ke folder uploads/{biometric_type}.
 
     Returns:
-        str: Path absolut ke file yang disimpan, atau None jika gagal.
+        tuple: (path absolut file yang disimpan, gambar BGR hasil decode),
+               atau (None, None) jika file ditolak atau bukan gambar valid.
     """
     if not file or file.filename == "":
         logger.warning("Upload rejected: No file or empty filename")
-        return None
+        return None, None
 
     if not _allowed_file(file.filename):
         logger.warning("Upload rejected: File extension not allowed for '%s'", file.filename)
-        return None
+        return None, None
 
     # Generate nama file unik untuk menghindari konflik
     ext = file.filename.rsplit(".", 1)[1].lower()
@@ -95,29 +273,19 @@ def _save_uploaded_file(file, biometric_type: str) -> str | None:
     os.makedirs(upload_folder, exist_ok=True)
     
     filepath = os.path.join(upload_folder, safe_name)
-    
-    # Baca dan resize gambar sebelum disimpan untuk menghemat disk & mempercepat proses
-    try:
-        file_bytes = np.frombuffer(file.read(), np.uint8)
-        img = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
-        if img is not None:
-            img = _resize_image(img, max_dim=640)
-            cv2.imwrite(filepath, img)
-        else:
-            # Jika gagal decode dengan cv2, simpan as is
-            file.seek(0)
-            file.save(filepath)
-    except Exception as e:
-        logger.warning("Gagal resize saat save: %s", str(e))
-        file.seek(0)
-        file.save(filepath)
-
-    logger.info("File saved to %s", filepath)
-
-    return filepath
 
+    # Salin mentah ke disk, lalu decode sekali dari file (resize jika terlalu besar)
+    _save_raw(file, filepath)
+    img = _decode_and_resize_on_disk(filepath, max_dim=640)
+    if img is None:
+        # Jangan simpan file yang bukan gambar valid
+        logger.warning("Upload rejected: Gagal decode gambar '%s'", file.filename)
+        os.remove(filepath)
+        return None, None
 
+    logger.info("File saved to %s", filepath)
 
+    return filepath, img
 
 
 def _extract_features(image_data: str | np.ndarray, biometric_type: str):
@@ -129,24 +297,44 @@ def _extract_features(image_data: str | np.ndarray, biometric_type: str):
     
     Returns:
         Embedding/deskriptor, atau None jika gagal.
+        Embedding wajah dikembalikan dalam bentuk unit-norm.
     """
     if biometric_type == "face":
-        return extract_face_embedding(image_data)
+        embedding = extract_face_embedding(image_data)
+        if embedding is None:
+            return None
+        return normalize_embedding(embedding)
     elif biometric_type == "palm":
         return extract_palm_features(image_data)
     return None
 
 
-def _serialize_features(features, biometric_type: str) -> str:
-    """Serialisasi fitur biometrik ke JSON string."""
+def _make_etag(*parts) -> str:
+    """Membuat ETag ringkas dari nilai-nilai yang menentukan isi response."""
+    return hashlib.blake2b("-".join(str(p) for p in parts).encode(), digest_size=16).hexdigest()
+
+
+def _etag_matches(etag: str) -> bool:
+    """
+    Mengecek If-None-Match terhadap ETag, termasuk varian berakhiran
+    ":gzip"/":br"/":zstd" dari Flask-Compress dan ETag weak dari proxy.
+    """
+    if_none_match = request.if_none_match
+    if if_none_match.contains_weak(etag):
+        return True
+    return any(if_none_match.contains_weak(f"{etag}:{suffix}") for suffix in _COMPRESSED_ETAG_SUFFIXES)
+
+
+def _serialize_features(features, biometric_type: str) -> bytes:
+    """Serialisasi fitur biometrik ke bytes untuk kolom LargeBinary."""
     if biometric_type == "face":
         return serialize_embedding(features)
     elif biometric_type == "palm":
         return serialize_descriptors(features)
-    return ""
+    return b""
 
 
-def _compare_features(features, stored_embedding: str, biometric_type: str):
+def _compare_features(features, stored_embedding: bytes, biometric_type: str):
     """
     Membandingkan fitur input dengan data tersimpan.
 
@@ -167,35 +355,56 @@ def _find_existing_match(input_features, biometric_type: str):
     Returns:
         tuple: (best_match_record, best_score) atau (None, 0.0)
     """
-    # Ambil semua data biometrik sesuai tipe dari database
-    stored_data = BiometricData.query.filter_by(
-        biometric_type=biometric_type
-    ).all()
+    if biometric_type == "face" and vector_search.is_enabled():
+        # Face (pgvector): nearest-neighbor dihitung di PostgreSQL, hanya top-1 yang dikirim
+        best_id, best_score = vector_search.nearest(input_features)
+        if best_id is None or best_score > face_threshold():
+            return None, 0.0
+        return db.session.get(BiometricData, best_id), best_score
 
-    if not stored_data:
-        return None, 0.0
+    # Ambil semua embedding sesuai tipe dari cache (dimuat dari database sekali)
+    ids, stored_data = embedding_cache.get(biometric_type)
 
-    # Bandingkan dengan setiap data yang tersimpan
-    best_match = None
-    best_score = float("inf") if biometric_type == "face" else 0.0
+    if not ids:
+        return None, 0.0
 
-    for record in stored_data:
+    if biometric_type == "face":
+        ann = embedding_cache.get_index(biometric_type)
+        if ann is not None:
+            # Face (galeri besar): ambil kandidat top-1 dari ANN index HNSW, lalu
+            # verifikasi kandidat itu saja dengan embedding float32 aslinya.
+            # Jarak ANN aproksimasi, beri kelonggaran 10% agar kandidat di batas tidak terlewat.
+            best_id, approx_score = ann.query(input_features)
+            if best_id is None or approx_score > face_threshold() * _ANN_THRESHOLD_SLACK:
+                return None, 0.0
+            candidate = db.session.get(BiometricData, best_id)
+            if candidate is None:
+                return None, 0.0
+            is_match, best_score = compare_face_embeddings(input_features, candidate.embedding)
+            return (candidate, best_score) if is_match else (None, 0.0)
+
+        # Face: semua embedding dibandingkan sekaligus dalam satu perkalian matriks
+        idx, best_score = find_best_face_match(input_features, stored_data)
+        if idx is None:
+            return None, 0.0
+        return db.session.get(BiometricData, ids[idx]), best_score
+
+    # Palm: bandingkan dengan setiap data yang tersimpan
+    best_match_id = None
+    best_score = 0.0
+
+    for record_id, stored_embedding in zip(ids, stored_data):
         is_match, score = _compare_features(
-            input_features, record.embedding, biometric_type
+            input_features, stored_embedding, biometric_type
         )
-        if is_match:
-            if biometric_type == "face":
-                # Face: skor lebih rendah = lebih cocok (cosine distance)
-                if score < best_score:
-                    best_score = score
-                    best_match = record
-            else:
-                # Palm: skor lebih tinggi = lebih cocok (match ratio)
-                if score > best_score:
-                    best_score = score
-                    best_match = record
-    
-    return best_match, best_score
+        # Palm: skor lebih tinggi = lebih cocok (match ratio)
+        if is_match and score > best_score:
+            best_score = score
+            best_match_id = record_id
+
+    if best_match_id is None:
+        return None, 0.0
+    return db.session.get(BiometricData, best_match_id), best_score
 
 
 @bp.route("/compare", methods=["POST"])
@@ -229,23 +438,18 @@ def compare_biometric():
         return error_response(message="Nama file kosong")
 
     try:
-        # Proses file di memori tanpa menyimpan ke disk
-        file_bytes = np.frombuffer(file.read(), np.uint8)
-        
-        # Decode gambar menggunakan OpenCV
+        # Proses file di memori tanpa menyimpan ke disk, decode langsung dari stream upload
         # cv2.IMREAD_COLOR cocok untuk face (DeepFace bisa handle BGR)
         # cv2.IMREAD_GRAYSCALE bisa untuk palm, tapi service palm sudah handle konversi jika dikasih BGR
         # Jadi kita pakai COLOR agar aman untuk keduanya (Palm service akan convert ke gray jika perlu)
-        img = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
+        # Gambar langsung di-resize (JPEG besar di-decode pada skala kecil) untuk mempercepat deteksi di CPU
+        img = _imdecode_stream(file.stream, max_dim=640)
 
         if img is None:
              return error_response(
                 message="File tidak valid atau format gambar tidak didukung."
             )
 
-        # Resize gambar untuk mempercepat proses deteksi wajah di CPU
-        img = _resize_image(img, max_dim=640)
-
         # Cek Liveness (Anti-Spoofing) khusus untuk Wajah  <-- NEW
         if biometric_type == 'face':
             is_real, liveness_score = check_liveness(img)
@@ -318,18 +522,14 @@ def register_biometric():
         return error_response(message="File gambar tidak ditemukan dalam request")
 
     file = request.files["file"]
-    filepath = _save_uploaded_file(file, biometric_type)
+    filepath, img = _save_uploaded_file(file, biometric_type)
     if filepath is None:
         return error_response(
             message="File tidak valid. Gunakan format: PNG, JPG, JPEG, BMP, atau TIFF"
         )
 
     try:
-        # Baca gambar menggunakan OpenCV NumPy untuk dicek Live/Spoof 
-        file_bytes = np.frombuffer(open(filepath, "rb").read(), np.uint8)
-        img = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
-        img = _resize_image(img, max_dim=640)
-
+        # Gambar hasil decode saat penyimpanan dipakai ulang, tidak dibaca lagi dari disk
         # Cek Liveness khusus wajah  <-- NEW
         if biometric_type == 'face':
             is_real, liveness_score = check_liveness(img)
@@ -344,8 +544,8 @@ def register_biometric():
                     errors={"liveness_score": round(liveness_score, 4)}
                 )
 
-        # Ekstrak fitur dari gambar
-        features = _extract_features(filepath, biometric_type)
+        # Ekstrak fitur dari gambar (numpy array)
+        features = _extract_features(img, biometric_type)
 
         if features is None:
             # Hapus file jika gagal
@@ -387,7 +587,12 @@ def register_biometric():
             embedding=serialized,
         )
         db.session.add(new_record)
+        if biometric_type == "face" and vector_search.is_enabled():
+            db.session.flush()
+            vector_search.store(new_record.id, features)
+        generation = embedding_cache.bump_generation(biometric_type)
         db.session.commit()
+        embedding_cache.add(new_record, generation)
 
         logger.info(
             "Data biometrik baru terdaftar: ID=%s, tipe=%s",
@@ -441,7 +646,9 @@ def delete_biometric(biometric_id: str):
 
         # Hapus record dari database
         db.session.delete(record)
+        generation = embedding_cache.bump_generation(record.biometric_type)
         db.session.commit()
+        embedding_cache.remove(biometric_id, generation)
 
         logger.info("Data biometrik dihapus: ID=%s", biometric_id)
 
@@ -482,6 +689,15 @@ def list_biometric():
     if biometric_type in ALLOWED_TYPES:
         query = query.filter_by(biometric_type=biometric_type)
 
+    # Data hanya berubah lewat register/delete, sehingga (jumlah, created_at terbaru)
+    # cukup untuk ETag. Dicek sebelum paginasi agar polling ulang tidak menserialisasi apa pun.
+    count, latest = query.with_entities(
+        func.count(BiometricData.id), func.max(BiometricData.created_at)
+    ).one()
+    etag = _make_etag(count, latest, biometric_type, page, limit)
+    if _etag_matches(etag):
+        return not_modified_response(etag)
+
     # Lakukan paginasi
     paginated_data = query.order_by(BiometricData.created_at.desc()).paginate(
         page=page, per_page=limit, error_out=False
@@ -498,11 +714,13 @@ def list_biometric():
         "has_prev": paginated_data.has_prev
     }
 
-    return success_response(
+    response, status_code = success_response(
         message=f"Menampilkan data halaman {paginated_data.page} dari {paginated_data.pages}",
         data=[record.to_dict() for record in records],
         meta=meta
     )
+    response.set_etag(etag)
+    return response, status_code
 
 
 @bp.route("/<string:biometric_id>", methods=["GET"])
@@ -524,10 +742,16 @@ def get_biometric(biometric_id: str):
             message=f"Data biometrik dengan ID {biometric_id} tidak ditemukan"
         )
 
-    return success_response(
+    etag = _make_etag(record.id, record.updated_at)
+    if _etag_matches(etag):
+        return not_modified_response(etag)
+
+    response, status_code = success_response(
         message="Data biometrik ditemukan",
         data=record.to_dict()
     )
+    response.set_etag(etag)
+    return response, status_code
 
 
 # ──────────────────────────────────────────────
@@ -6,6 +6,8 @@ from app.extensions import db
 @with_appcontext
 def reset_db_command():
     """Clear existing data and create new tables."""
+    from app.services.embedding_cache import init_generations
+
     click.confirm("This will delete all data in the database. Continue?", abort=True)
     
     click.echo("Dropping all tables...")
@@ -13,9 +15,64 @@ def reset_db_command():
     
     click.echo("Creating all tables...")
     db.create_all()
+    init_generations()
     
-    click.echo("Database reset and re-initialized successfully.")
+    click.echo("Database reset and re-initialized successfully. Restart the workers to drop their in-memory caches.")
+
+@click.command("init-pgvector")
+@click.option("--dim", type=int, default=None, help="Embedding dimension (default: taken from stored face data).")
+@with_appcontext
+def init_pgvector_command(dim):
+    """Add the pgvector column + HNSW index and backfill existing face embeddings."""
+    from app.models.biometric import BiometricData
+    from app.services import vector_search
+
+    if dim is None:
+        record = BiometricData.query.filter_by(biometric_type="face").first()
+        if record is None:
+            raise click.UsageError("No face data stored yet, pass --dim explicitly.")
+        dim = len(record.embedding) // 4
+
+    click.echo(f"Preparing pgvector column (dim={dim})...")
+    filled = vector_search.init_schema(dim)
+    click.echo(f"pgvector ready, {filled} face embeddings backfilled. Set FACE_SEARCH_BACKEND=pgvector to use it.")
+
+@click.command("migrate-embeddings")
+@click.option("--drop-palm", is_flag=True, help="Delete legacy palm records instead of keeping them for re-enrollment.")
+@with_appcontext
+def migrate_embeddings_command(drop_palm):
+    """Convert legacy JSON text embeddings to the binary (bytea) format."""
+    from app.services.embedding_migration import migrate_legacy_embeddings
+
+    click.echo("Converting legacy embeddings...")
+    faces, palms = migrate_legacy_embeddings(drop_palm=drop_palm)
+    click.echo(f"{faces} face embeddings converted.")
+    if palms:
+        action = "deleted" if drop_palm else "kept but must be re-enrolled"
+        click.echo(f"{palms} legacy palm templates {action}.")
+    click.echo("Run init-pgvector again if FACE_SEARCH_BACKEND=pgvector.")
+
+@click.command("quantize-liveness")
+@click.option("--limit", type=int, default=200, help="Maximum number of registered face images used for calibration.")
+@with_appcontext
+def quantize_liveness_command(limit):
+    """Quantize the liveness model to INT8 using registered face images for calibration."""
+    from app.models.biometric import BiometricData
+    from app.services import liveness_service
+
+    records = BiometricData.query.filter_by(biometric_type="face").limit(limit).all()
+    image_paths = [record.image_path for record in records]
+
+    click.echo(f"Quantizing liveness model with {len(image_paths)} calibration images...")
+    try:
+        int8_path, used = liveness_service.quantize_model(image_paths)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"INT8 model saved to {int8_path} ({used} faces). Restart the workers to load it.")
 
 def register_commands(app):
     """Register CLI commands with the application instance."""
     app.cli.add_command(reset_db_command)
+    app.cli.add_command(init_pgvector_command)
+    app.cli.add_command(migrate_embeddings_command)
+    app.cli.add_command(quantize_liveness_command)
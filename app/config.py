@@ -39,11 +39,37 @@ class Config:
     FACE_MODEL = os.environ.get("FACE_MODEL", "VGG-Face")
     # Threshold rekomendasi untuk ArcFace + Cosine Similarity adalah 0.68
     FACE_THRESHOLD = float(os.environ.get("FACE_THRESHOLD", "0.40"))
+    # Opsional: model embedding hasil export ONNX dari FACE_MODEL (dimuat sekali saat startup).
+    # Jika kosong, ekstraksi embedding memakai DeepFace.represent.
+    FACE_ONNX_MODEL_PATH = os.environ.get("FACE_ONNX_MODEL_PATH", "")
+    # 0 = biarkan ONNX Runtime memilih jumlah thread
+    FACE_ONNX_THREADS = int(os.environ.get("FACE_ONNX_THREADS", "0"))
+    # Detector wajah YuNet (cv2.FaceDetectorYN). Jika model gagal dimuat/diunduh, memakai Haar cascade.
+    FACE_DETECTOR_MODEL_PATH = os.environ.get("FACE_DETECTOR_MODEL_PATH", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "models", "face_detection_yunet_2023mar.onnx"))
+    FACE_DETECTOR_MODEL_URL = os.environ.get("FACE_DETECTOR_MODEL_URL", "https://github.com/opencv/opencv_zoo/raw/main/models/face_detection_yunet/face_detection_yunet_2023mar.onnx")
+    # Presisi matriks embedding di cache memori: float32 | float16 | int8
+    # (database tetap menyimpan float32; float16/int8 mengurangi RAM & bandwidth scan 2x/4x)
+    FACE_INDEX_PRECISION = os.environ.get("FACE_INDEX_PRECISION", "float32")
+    # ANN index HNSW (butuh paket opsional hnswlib), dipakai jika jumlah wajah >= FACE_ANN_MIN_ITEMS
+    FACE_ANN_MIN_ITEMS = int(os.environ.get("FACE_ANN_MIN_ITEMS", "1000"))
+    FACE_ANN_INDEX_PATH = os.environ.get("FACE_ANN_INDEX_PATH", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "models", "face_hnsw.bin"))
+    # Backend pencarian wajah: memory (cache di proses) | pgvector (butuh `flask init-pgvector`)
+    FACE_SEARCH_BACKEND = os.environ.get("FACE_SEARCH_BACKEND", "memory")
+    # Jumlah thread scan galeri wajah per worker; default membagi core ke semua worker
+    # Gunicorn (WEB_CONCURRENCY) agar total thread tidak melebihi jumlah core
+    FACE_COMPARE_THREADS = int(os.environ.get(
+        "FACE_COMPARE_THREADS",
+        max(1, (os.cpu_count() or 1) // int(os.environ.get("WEB_CONCURRENCY", "1")))
+    ))
     
     # Liveness Detection Config
     LIVENESS_MODEL_PATH = os.environ.get("LIVENESS_MODEL_PATH", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "models", "liveness.onnx"))
     LIVENESS_THRESHOLD = float(os.environ.get("LIVENESS_THRESHOLD", "0.80"))
     LIVENESS_MODEL_URL = "https://github.com/yakhyo/face-anti-spoofing/releases/download/weights/MiniFASNetV2.onnx"
+    # 0 = biarkan ONNX Runtime memilih jumlah thread (jumlah core fisik)
+    LIVENESS_ONNX_THREADS = int(os.environ.get("LIVENESS_ONNX_THREADS", "0"))
+    # Opsional: path cache graph hasil optimasi ORT (spesifik hardware, kosong = tidak disimpan)
+    LIVENESS_OPTIMIZED_MODEL_PATH = os.environ.get("LIVENESS_OPTIMIZED_MODEL_PATH", "")
 
     # Palm Vein Recognition (OpenCV ORB)
     PALM_MATCH_THRESHOLD = float(os.getenv("PALM_MATCH_THRESHOLD", 0.15))
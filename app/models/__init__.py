@@ -1 +1 @@
-from app.models.biometric import BiometricData  # noqa: F401
+from app.models.biometric import BiometricData, BiometricGeneration  # noqa: F401
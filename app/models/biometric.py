@@ -2,7 +2,8 @@
 Model BiometricData
 ====================
 Menyimpan data biometrik (wajah/telapak tangan) beserta
-embedding/deskriptor untuk proses perbandingan.
+embedding/deskriptor untuk proses perbandingan, serta penanda
+generasi data per tipe untuk sinkronisasi cache antar worker.
 """
 
 from datetime import datetime, timezone
@@ -27,9 +28,9 @@ class BiometricData(db.Model):
         comment="Path ke file gambar referensi"
     )
     embedding = db.Column(
-        db.Text,
+        db.LargeBinary,
         nullable=False,
-        comment="JSON: face embedding vector atau palm ORB descriptors"
+        comment="Bytes: face embedding float32 atau palm ORB descriptors uint8"
     )
     created_at = db.Column(
         db.DateTime,
@@ -56,3 +57,19 @@ class BiometricData(db.Model):
             "created_at": self.created_at.isoformat() if self.created_at else None,
             "updated_at": self.updated_at.isoformat() if self.updated_at else None,
         }
+
+
+class BiometricGeneration(db.Model):
+    """
+    Penanda perubahan data per tipe biometrik.
+    Dinaikkan di transaksi yang sama dengan setiap register/delete, sehingga
+    worker cukup membaca satu baris (lookup primary key) untuk tahu apakah cache-nya usang.
+    """
+
+    __tablename__ = "biometric_generation"
+
+    biometric_type = db.Column(db.String(10), primary_key=True)
+    generation = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<BiometricGeneration type={self.biometric_type} generation={self.generation}>"
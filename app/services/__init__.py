@@ -1,3 +1,3 @@
-from .face_service import extract_face_embedding, compare_face_embeddings, serialize_embedding
+from .face_service import extract_face_embedding, compare_face_embeddings, serialize_embedding, deserialize_embedding
 from .palm_service import extract_palm_features, compare_palm_features, serialize_descriptors
-from .liveness_service import check_liveness
+from .liveness_service import check_liveness, check_liveness_batch
@@ -0,0 +1,128 @@
+"""
+Numerical Kernels
+==================
+Kernel perhitungan jarak embedding yang dipakai pada pencarian wajah.
+Jika Numba terpasang (opsional, tidak ada di requirements), kernel
+dikompilasi ke kode native paralel; jika tidak, memakai NumPy/BLAS.
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+try:
+    from numba import config as numba_config, njit, prange, set_num_threads
+except ImportError:
+    njit = None
+
+
+# Jumlah baris per potongan saat matriks non-float32 di-upcast untuk BLAS
+_UPCAST_CHUNK_ROWS = 8192
+
+# Jumlah baris minimal sebelum scan NumPy dipecah ke _compare_pool
+_PARALLEL_MIN_ROWS = 32768
+
+# Thread pool untuk memecah scan galeri wajah per potongan baris (NumPy/BLAS melepas GIL).
+# Ukurannya FACE_COMPARE_THREADS per worker, diatur oleh init_kernels.
+_compare_pool = None
+_compare_threads = 1
+
+# Layer threading bawaan Numba (workqueue, jika TBB/OpenMP tidak ada) membatalkan proses
+# bila kernel paralel dipanggil dari beberapa thread sekaligus; kernel sudah memakai
+# semua thread worker, sehingga panggilan dari thread request cukup diserialkan
+_numba_lock = threading.Lock()
+_numba_threads = 1
+
+# Presisi matriks yang didukung kernel Numba (Numba belum mendukung float16 di CPU)
+_KERNEL_DTYPES = (np.float32, np.int8)
+
+if njit is not None:
+    @njit(cache=True, parallel=True, fastmath=True)
+    def cosine_dist_all(q, M, scale, out):
+        """Cosine distance q terhadap setiap baris M (keduanya sudah unit-norm, M dikali scale)."""
+        for i in prange(M.shape[0]):
+            # Akumulasi float32 agar loop divektorisasi dengan lane float32 (bukan float64)
+            s = np.float32(0.0)
+            for j in range(M.shape[1]):
+                s += q[j] * np.float32(M[i, j])
+            out[i] = 1.0 - s * scale
+
+    # Kompilasi sekali saat import (untuk setiap presisi matriks) agar request
+    # pertama tidak menanggung biaya JIT
+    for _dtype in _KERNEL_DTYPES:
+        cosine_dist_all(
+            np.zeros(1, dtype=np.float32),
+            np.zeros((1, 1), dtype=_dtype),
+            1.0,
+            np.empty(1, dtype=np.float32),
+        )
+    logger.info("Kernel Numba cosine_dist_all aktif")
+else:
+    cosine_dist_all = None
+
+
+def init_kernels(app):
+    """
+    Menyiapkan thread pool scan galeri sesuai FACE_COMPARE_THREADS, sekali per worker.
+    Nilai yang sama membatasi jumlah thread kernel Numba.
+    """
+    global _compare_pool, _compare_threads, _numba_threads
+    _compare_threads = max(1, app.config.get("FACE_COMPARE_THREADS", 1))
+    if njit is not None:
+        # set_num_threads tidak boleh melebihi NUMBA_NUM_THREADS (default: jumlah core)
+        _numba_threads = min(_compare_threads, numba_config.NUMBA_NUM_THREADS)
+    if _compare_threads > 1 and _compare_pool is None:
+        _compare_pool = ThreadPoolExecutor(max_workers=_compare_threads, thread_name_prefix="compare")
+
+
+def cosine_distances(query: np.ndarray, matrix: np.ndarray, scale: float = 1.0) -> np.ndarray:
+    """
+    Menghitung cosine distance query (D,) terhadap seluruh baris matrix (N, D).
+    Kedua input diasumsikan sudah dinormalisasi L2; matrix boleh berupa
+    float32, float16, atau int8 terkuantisasi (nilai asli = matrix * scale).
+
+    Returns:
+        np.ndarray: Array (N,) float32 berisi cosine distance.
+    """
+    query = np.ascontiguousarray(query, dtype=np.float32)
+    out = np.empty(matrix.shape[0], dtype=np.float32)
+    if cosine_dist_all is not None and matrix.dtype in _KERNEL_DTYPES:
+        matrix = np.ascontiguousarray(matrix)
+        with _numba_lock:
+            # Jumlah thread Numba diatur per thread pemanggil, batasi ke jatah worker ini
+            set_num_threads(_numba_threads)
+            cosine_dist_all(query, matrix, scale, out)
+        return out
+
+    if matrix.shape[0] < _PARALLEL_MIN_ROWS or _compare_pool is None:
+        _distances_into(query, matrix, np.float32(scale), out)
+        return out
+
+    # Galeri besar: setiap thread menghitung satu potongan baris ke slice out masing-masing
+    step = -(-matrix.shape[0] // _compare_threads)
+    futures = [
+        _compare_pool.submit(
+            _distances_into, query, matrix[start:start + step], np.float32(scale), out[start:start + step]
+        )
+        for start in range(0, matrix.shape[0], step)
+    ]
+    for future in futures:
+        future.result()
+    return out
+
+
+def _distances_into(query: np.ndarray, matrix: np.ndarray, scale: np.float32, out: np.ndarray):
+    """Menulis cosine distance query terhadap baris matrix ke out (panjang sama dengan matrix)."""
+    if matrix.dtype == np.float32:
+        np.matmul(matrix, query, out=out)
+    else:
+        # NumPy tidak punya GEMV float16/int8, upcast per potongan agar tetap memakai SGEMV
+        # tanpa menyalin seluruh matriks sekaligus
+        for start in range(0, matrix.shape[0], _UPCAST_CHUNK_ROWS):
+            chunk = matrix[start:start + _UPCAST_CHUNK_ROWS].astype(np.float32)
+            np.matmul(chunk, query, out=out[start:start + len(chunk)])
+    out *= -scale
+    out += 1.0
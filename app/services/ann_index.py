@@ -0,0 +1,165 @@
+"""
+ANN Index (HNSW)
+=================
+Index nearest-neighbor aproksimasi untuk embedding wajah menggunakan hnswlib,
+sehingga pencarian 1:N menjadi O(log N) alih-alih scan linear.
+
+hnswlib bersifat opsional (tidak ada di requirements); jika tidak terpasang,
+pencarian tetap memakai scan matriks di embedding cache.
+"""
+
+import os
+import hashlib
+import logging
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+# Parameter HNSW: M = jumlah tetangga per node, ef = lebar pencarian
+_HNSW_M = 16
+_HNSW_EF_CONSTRUCTION = 200
+_HNSW_EF_SEARCH = 64
+
+
+def is_available() -> bool:
+    """Mengecek apakah hnswlib terpasang."""
+    return hnswlib is not None
+
+
+def label_for(biometric_id: str) -> int:
+    """Label integer stabil (antar proses) untuk ID biometrik."""
+    digest = hashlib.blake2b(biometric_id.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little") >> 1
+
+
+class AnnIndex:
+    """Index HNSW (cosine) beserta pemetaan label -> ID biometrik."""
+
+    def __init__(self, dim: int, capacity: int):
+        self._index = hnswlib.Index(space="cosine", dim=dim)
+        self._index.init_index(
+            max_elements=max(capacity, 1),
+            ef_construction=_HNSW_EF_CONSTRUCTION,
+            M=_HNSW_M,
+        )
+        self._index.set_ef(_HNSW_EF_SEARCH)
+        self._ids = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, ids: list[str], matrix: np.ndarray, path: str | None = None) -> "AnnIndex":
+        """
+        Membuat index dari seluruh embedding. Jika path berisi index tersimpan,
+        index dimuat dari disk lalu disinkronkan (tambah yang belum ada, tandai
+        yang sudah dihapus) tanpa build ulang.
+        """
+        labels = np.array([label_for(biometric_id) for biometric_id in ids], dtype=np.uint64)
+        ann = cls(matrix.shape[1], len(ids) * 2)
+        ann._ids = dict(zip(labels.tolist(), ids))
+
+        if path and os.path.exists(path):
+            changed = ann._load(path, labels, matrix)
+            if changed is not None:
+                logger.info("ANN index dimuat dari %s (%d item, %d disinkronkan)", path, len(ids), changed)
+                if changed:
+                    ann.save(path)
+                return ann
+
+        ann._index.add_items(np.asarray(matrix, dtype=np.float32), labels)
+        logger.info("ANN index dibangun: %d item", len(ids))
+
+        if path:
+            ann.save(path)
+        return ann
+
+    def _load(self, path: str, labels: np.ndarray, matrix: np.ndarray) -> int | None:
+        """
+        Memuat index dari disk dan menyinkronkannya dengan data saat ini.
+
+        Returns:
+            int: Jumlah item yang ditambahkan/ditandai terhapus, atau None jika
+            index tidak bisa dipakai (gagal dimuat atau terlalu banyak item usang).
+        """
+        index = hnswlib.Index(space="cosine", dim=self._index.dim)
+        try:
+            index.load_index(path, max_elements=self._index.get_max_elements())
+        except RuntimeError as e:
+            logger.warning("Gagal memuat ANN index dari %s: %s", path, str(e))
+            return None
+
+        stored = set(index.get_ids_list())
+        stale = stored.difference(self._ids)
+        if len(stale) > len(self._ids) // 2:
+            # Slot terhapus terlalu banyak, build ulang lebih rapat dan cepat dicari
+            logger.info("ANN index di %s berisi %d item usang, build ulang", path, len(stale))
+            return None
+
+        for label in stale:
+            try:
+                index.mark_deleted(label)
+            except RuntimeError:
+                # Sudah ditandai terhapus sebelum disimpan
+                pass
+
+        missing = np.fromiter((label not in stored for label in labels.tolist()), dtype=bool, count=len(labels))
+        index.set_ef(_HNSW_EF_SEARCH)
+        self._index = index
+        if missing.any():
+            self._add_items(labels[missing], matrix[missing])
+        return len(stale) + int(missing.sum())
+
+    def save(self, path: str):
+        """Menyimpan index ke disk secara atomik (aman untuk beberapa worker)."""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with self._lock:
+                self._index.save_index(tmp_path)
+            os.replace(tmp_path, path)
+        except (OSError, RuntimeError) as e:
+            logger.warning("Gagal menyimpan ANN index ke %s: %s", path, str(e))
+
+    def _add_items(self, labels: np.ndarray, matrix: np.ndarray):
+        """Menambahkan beberapa embedding sekaligus, memperbesar kapasitas index jika perlu."""
+        needed = self._index.get_current_count() + len(labels)
+        if needed > self._index.get_max_elements():
+            self._index.resize_index(max(needed, self._index.get_max_elements() * 2))
+        self._index.add_items(np.asarray(matrix, dtype=np.float32), labels)
+
+    def add(self, biometric_id: str, vector: np.ndarray):
+        """Menambahkan satu embedding ke index."""
+        self.add_many([biometric_id], np.asarray(vector, dtype=np.float32)[np.newaxis, :])
+
+    def add_many(self, ids: list[str], matrix: np.ndarray):
+        """Menambahkan beberapa embedding (matriks (N, D)) ke index dalam satu panggilan."""
+        labels = np.array([label_for(biometric_id) for biometric_id in ids], dtype=np.uint64)
+        with self._lock:
+            self._add_items(labels, matrix)
+            self._ids.update(zip(labels.tolist(), ids))
+
+    def remove(self, biometric_id: str):
+        """Menandai embedding sebagai terhapus (tidak akan muncul di hasil pencarian)."""
+        label = label_for(biometric_id)
+        with self._lock:
+            if self._ids.pop(label, None) is not None:
+                self._index.mark_deleted(label)
+
+    def query(self, vector: np.ndarray) -> tuple[str | None, float]:
+        """
+        Mencari embedding terdekat.
+
+        Returns:
+            tuple: (ID biometrik terdekat atau None, cosine distance)
+        """
+        with self._lock:
+            if not self._ids:
+                return None, float("inf")
+            labels, distances = self._index.knn_query(
+                np.asarray(vector, dtype=np.float32)[np.newaxis, :], k=1
+            )
+        return self._ids.get(int(labels[0][0])), float(distances[0][0])
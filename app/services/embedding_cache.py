@@ -0,0 +1,328 @@
+"""
+Embedding Cache
+================
+Cache in-process untuk embedding/deskriptor biometrik per tipe.
+Dimuat sekali dari database pada request pertama, lalu diperbarui
+saat register/delete sehingga /compare tidak perlu memuat ulang seluruh data.
+
+Setiap worker Gunicorn memiliki cache sendiri. Agar perubahan dari worker
+lain tetap terlihat, setiap akses membaca nomor generasi per tipe
+(tabel biometric_generation, satu lookup primary key) yang dinaikkan di
+transaksi register/delete. Jika berbeda, ID di database dicocokkan dengan
+cache: hanya baris baru yang dimuat dan baris yang sudah dihapus dibuang;
+muat ulang penuh (termasuk build ANN) hanya saat cold start.
+"""
+
+import logging
+import threading
+import numpy as np
+from flask import current_app
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app.extensions import db
+from app.models.biometric import BiometricData, BiometricGeneration
+from app.services import ann_index
+from app.services.embedding_migration import is_legacy, raw_embedding_column
+from app.services.face_service import deserialize_embedding, quantize_embeddings
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.RLock()
+
+# biometric_type -> {"ids", "data", "generation", "ann"}
+# data berupa matriks (N, D) untuk face (presisi sesuai FACE_INDEX_PRECISION)
+# atau list bytes deskriptor untuk palm; ann berupa AnnIndex (face, opsional)
+_entries = {}
+
+# Jumlah ID per query IN saat memuat baris yang belum ada di cache
+_ID_CHUNK = 500
+
+
+def _precision() -> str:
+    return current_app.config.get("FACE_INDEX_PRECISION", "float32")
+
+
+def _use_ann(count: int) -> bool:
+    """ANN hanya dipakai jika hnswlib tersedia dan galeri cukup besar (scan matriks lebih murah di bawahnya)."""
+    return ann_index.is_available() and count >= current_app.config.get("FACE_ANN_MIN_ITEMS", 1000)
+
+
+def _generation(biometric_type: str) -> int:
+    """Membaca nomor generasi data satu tipe (0 jika belum pernah berubah)."""
+    generation = db.session.execute(
+        select(BiometricGeneration.generation)
+        .where(BiometricGeneration.biometric_type == biometric_type)
+    ).scalar()
+    return generation or 0
+
+
+def init_generations():
+    """Menyiapkan baris generasi untuk setiap tipe biometrik (dipanggil setelah create_all)."""
+    for biometric_type in ("face", "palm"):
+        if db.session.get(BiometricGeneration, biometric_type) is not None:
+            continue
+        db.session.add(BiometricGeneration(biometric_type=biometric_type, generation=0))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Worker lain sudah membuat baris yang sama
+            db.session.rollback()
+
+
+def bump_generation(biometric_type: str) -> int:
+    """
+    Menaikkan nomor generasi satu tipe di transaksi yang sedang berjalan.
+    Panggil sebelum commit register/delete; baris generasi terkunci sampai commit
+    sehingga perubahan dari beberapa worker mendapat nomor berurutan.
+
+    Returns:
+        int: Nomor generasi baru.
+    """
+    result = db.session.execute(
+        update(BiometricGeneration)
+        .where(BiometricGeneration.biometric_type == biometric_type)
+        .values(generation=BiometricGeneration.generation + 1)
+    )
+    if result.rowcount == 0:
+        db.session.add(BiometricGeneration(biometric_type=biometric_type, generation=1))
+        db.session.flush()
+    return _generation(biometric_type)
+
+
+def _read_rows(biometric_type: str, rows) -> tuple[list[str], list, int]:
+    """Mengumpulkan (id, embedding mentah) menjadi ids + list vektor/bytes, melewati baris format lama."""
+    ids, vectors, skipped = [], [], 0
+    for record_id, embedding in rows:
+        if is_legacy(embedding):
+            skipped += 1
+            continue
+        ids.append(record_id)
+        vectors.append(deserialize_embedding(embedding) if biometric_type == "face" else bytes(embedding))
+    return ids, vectors, skipped
+
+
+def _warn_legacy(biometric_type: str, skipped: int):
+    if skipped:
+        logger.warning(
+            "Melewati %d data %s berformat lama (teks), jalankan `flask migrate-embeddings`",
+            skipped, biometric_type
+        )
+
+
+def _load(biometric_type: str, generation: int) -> dict:
+    """
+    Memuat seluruh data biometrik satu tipe dari database.
+    Embedding wajah langsung ditulis ke matriks (N, D) yang dialokasikan
+    sekali berdasarkan jumlah baris, tanpa menyimpan bytes per baris.
+    """
+    count = db.session.query(func.count(BiometricData.id)).filter(
+        BiometricData.biometric_type == biometric_type
+    ).scalar()
+
+    # Hanya kolom yang dibutuhkan, di-stream per batch tanpa membuat objek ORM.
+    # Embedding dibaca mentah agar baris format lama (teks) bisa dilewati, bukan membuat error.
+    rows = db.session.query(
+        BiometricData.id, raw_embedding_column()
+    ).filter_by(biometric_type=biometric_type).yield_per(2048)
+
+    ids, buffers, matrix, skipped = [], [], None, 0
+    for record_id, embedding in rows:
+        if is_legacy(embedding):
+            skipped += 1
+            continue
+        if biometric_type == "face":
+            vector = deserialize_embedding(embedding)
+            if matrix is None:
+                matrix = np.empty((max(count, 1), vector.shape[0]), dtype=np.float32)
+            elif len(ids) == matrix.shape[0]:
+                # Ada data baru sejak count dihitung, perbesar matriks
+                matrix = np.concatenate([matrix, np.empty_like(matrix)])
+            matrix[len(ids)] = vector
+        else:
+            buffers.append(bytes(embedding))
+        ids.append(record_id)
+
+    ann = None
+    if biometric_type == "face":
+        if matrix is None:
+            data = np.empty((0, 0), dtype=np.float32)
+        else:
+            data = matrix[:len(ids)]
+        if _use_ann(len(ids)):
+            ann = ann_index.AnnIndex.build(
+                ids, data, current_app.config.get("FACE_ANN_INDEX_PATH")
+            )
+        data = quantize_embeddings(data, _precision())
+    else:
+        data = buffers
+
+    _warn_legacy(biometric_type, skipped)
+    logger.info("Embedding cache dimuat: tipe=%s, jumlah=%d", biometric_type, len(ids))
+    return {"ids": ids, "data": data, "generation": generation, "ann": ann}
+
+
+def _refresh(biometric_type: str, entry: dict, generation: int) -> dict:
+    """
+    Memperbarui entry cache secara inkremental setelah database diubah worker lain.
+    Himpunan ID di database dicocokkan dengan cache: embedding hanya dimuat untuk ID
+    yang belum ada di cache, dan ID yang sudah tidak ada di database dibuang.
+    Tidak bergantung pada created_at, sehingga baris yang commit terlambat tetap terlihat.
+    """
+    ids, data, ann = entry["ids"], entry["data"], entry["ann"]
+
+    current = {
+        record_id for (record_id,) in
+        db.session.query(BiometricData.id).filter(BiometricData.biometric_type == biometric_type)
+    }
+    known = set(ids)
+    missing = list(current - known)
+    removed = known - current
+
+    # Embedding ID baru dimuat per potongan agar klausa IN tidak terlalu panjang
+    new_ids, new_vectors, skipped = [], [], 0
+    for start in range(0, len(missing), _ID_CHUNK):
+        rows = db.session.query(BiometricData.id, raw_embedding_column()).filter(
+            BiometricData.id.in_(missing[start:start + _ID_CHUNK])
+        )
+        chunk_ids, chunk_vectors, chunk_skipped = _read_rows(biometric_type, rows)
+        new_ids += chunk_ids
+        new_vectors += chunk_vectors
+        skipped += chunk_skipped
+    _warn_legacy(biometric_type, skipped)
+
+    if removed:
+        keep = [i for i, record_id in enumerate(ids) if record_id in current]
+        if ann is not None:
+            for record_id in removed:
+                ann.remove(record_id)
+        ids = [ids[i] for i in keep]
+        data = data[keep] if biometric_type == "face" else [data[i] for i in keep]
+
+    if new_ids:
+        if biometric_type == "face":
+            if ann is None and _use_ann(len(ids) + len(new_ids)):
+                # Galeri baru melewati batas ANN: muat ulang penuh agar index dibangun
+                return _load(biometric_type, generation)
+            vectors = np.vstack(new_vectors)
+            if ann is not None:
+                ann.add_many(new_ids, vectors)
+            vectors = quantize_embeddings(vectors, _precision())
+            data = vectors if data.size == 0 else np.vstack([data, vectors])
+        else:
+            data = data + new_vectors
+        ids = ids + new_ids
+
+    logger.info(
+        "Embedding cache diperbarui: tipe=%s, baru=%d, dihapus=%d, jumlah=%d",
+        biometric_type, len(new_ids), len(removed), len(ids)
+    )
+    return {"ids": ids, "data": data, "generation": generation, "ann": ann}
+
+
+def get(biometric_type: str) -> tuple[list[str], np.ndarray | list[bytes]]:
+    """
+    Mengambil data cache untuk satu tipe biometrik, memuat dari database
+    jika belum ada, atau memperbaruinya jika database sudah diubah oleh worker lain.
+
+    Returns:
+        tuple: (ids, data) — data berupa matriks (N, D) untuk face
+        atau list bytes deskriptor untuk palm.
+    """
+    generation = _generation(biometric_type)
+    with _lock:
+        entry = _entries.get(biometric_type)
+        if entry is None:
+            entry = _entries[biometric_type] = _load(biometric_type, generation)
+        elif entry["generation"] != generation:
+            entry = _entries[biometric_type] = _refresh(biometric_type, entry, generation)
+        return entry["ids"], entry["data"]
+
+
+def get_index(biometric_type: str) -> "ann_index.AnnIndex | None":
+    """Mengambil ANN index untuk tipe biometrik (panggil setelah get()), None jika tidak dipakai."""
+    with _lock:
+        entry = _entries.get(biometric_type)
+        return entry["ann"] if entry is not None else None
+
+
+def _advance(entry: dict, generation: int) -> int:
+    """
+    Generasi entry setelah perubahan lokal bernomor generation: hanya maju jika cache
+    tepat satu generasi di belakang. Jika ada perubahan lain di antaranya, generasi
+    lama dipertahankan agar akses berikutnya mencocokkan ID dengan database.
+    """
+    return generation if entry["generation"] == generation - 1 else entry["generation"]
+
+
+def add(record: BiometricData, generation: int):
+    """
+    Menambahkan record yang baru tersimpan ke cache (jika cache tipe tersebut sudah dimuat).
+
+    Args:
+        record: Record yang sudah di-commit.
+        generation: Nomor generasi dari bump_generation() di transaksi register.
+    """
+    with _lock:
+        entry = _entries.get(record.biometric_type)
+        if entry is None or record.id in entry["ids"]:
+            # Belum dimuat, atau sudah terbawa refresh dari thread lain
+            return
+
+        ann = entry["ann"]
+
+        if record.biometric_type == "face":
+            embedding = deserialize_embedding(record.embedding)
+            if ann is not None:
+                ann.add(record.id, embedding)
+            elif _use_ann(len(entry["ids"]) + 1):
+                # Galeri baru melewati batas ANN: muat ulang dari database agar index dibangun
+                _entries.pop(record.biometric_type)
+                return
+
+            vector = quantize_embeddings(embedding, _precision())
+            if entry["data"].size == 0:
+                data = vector[np.newaxis, :].copy()
+            else:
+                data = np.vstack([entry["data"], vector])
+        else:
+            data = entry["data"] + [record.embedding]
+
+        # Ganti entry secara utuh agar pembaca yang sedang berjalan tetap konsisten
+        _entries[record.biometric_type] = {
+            "ids": entry["ids"] + [record.id],
+            "data": data,
+            "generation": _advance(entry, generation),
+            "ann": ann,
+        }
+
+
+def remove(biometric_id: str, generation: int):
+    """
+    Menghapus record dari cache berdasarkan ID.
+
+    Args:
+        biometric_id: ID record yang sudah dihapus dari database.
+        generation: Nomor generasi dari bump_generation() di transaksi delete.
+    """
+    with _lock:
+        for biometric_type, entry in _entries.items():
+            if biometric_id not in entry["ids"]:
+                continue
+
+            idx = entry["ids"].index(biometric_id)
+            ids = entry["ids"][:idx] + entry["ids"][idx + 1:]
+            if biometric_type == "face":
+                data = np.delete(entry["data"], idx, axis=0)
+                if entry["ann"] is not None:
+                    entry["ann"].remove(biometric_id)
+            else:
+                data = entry["data"][:idx] + entry["data"][idx + 1:]
+
+            _entries[biometric_type] = {
+                "ids": ids,
+                "data": data,
+                "generation": _advance(entry, generation),
+                "ann": entry["ann"],
+            }
+            return
@@ -0,0 +1,132 @@
+"""
+Embedding Migration
+====================
+Mengubah data embedding format lama (teks JSON di kolom Text) ke format
+biner saat ini (kolom bytea): embedding wajah menjadi bytes float32
+ter-normalisasi L2, template palm lama ditandai untuk registrasi ulang
+(deskriptornya berasal dari preprocessing lama dan tidak kompatibel).
+
+Dijalankan lewat perintah `flask migrate-embeddings` (lihat app/cli.py).
+"""
+
+import os
+import json
+import logging
+from sqlalchemy import delete, select, text, type_coerce, update
+from sqlalchemy.types import NullType
+
+from app.extensions import db
+from app.models.biometric import BiometricData
+from app.services.face_service import normalize_embedding, serialize_embedding
+
+logger = logging.getLogger(__name__)
+
+
+def raw_embedding_column():
+    """Kolom embedding tanpa konversi tipe SQLAlchemy (nilai mentah driver: bytes/memoryview/str)."""
+    return type_coerce(BiometricData.embedding, NullType()).label("embedding")
+
+
+def is_legacy(value) -> bool:
+    """Mengecek apakah nilai mentah kolom embedding masih berupa teks (format lama)."""
+    return isinstance(value, str)
+
+
+def _parse_legacy(value) -> list | None:
+    """Membaca embedding JSON format lama; None jika nilai sudah berformat biner."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        try:
+            value = bytes(value).decode("ascii")
+        except UnicodeDecodeError:
+            return None
+    try:
+        data = json.loads(value)
+    except ValueError:
+        return None
+    return data if isinstance(data, list) else None
+
+
+def _ensure_binary_column():
+    """Mengubah tipe kolom embedding dari text ke bytea (PostgreSQL); isi teks dipertahankan sebagai bytes."""
+    if db.engine.dialect.name != "postgresql":
+        # SQLite bertipe dinamis, cukup menulis ulang nilainya
+        return
+    data_type = db.session.execute(
+        text(
+            "SELECT data_type FROM information_schema.columns "
+            "WHERE table_name = 'biometric_data' AND column_name = 'embedding'"
+        )
+    ).scalar()
+    if data_type != "bytea":
+        logger.info("Mengubah tipe kolom embedding dari %s ke bytea...", data_type)
+        db.session.execute(
+            text(
+                "ALTER TABLE biometric_data ALTER COLUMN embedding TYPE bytea "
+                "USING convert_to(embedding, 'UTF8')"
+            )
+        )
+
+
+def migrate_legacy_embeddings(drop_palm: bool = False) -> tuple[int, int]:
+    """
+    Mengonversi seluruh embedding format lama ke format biner.
+
+    Args:
+        drop_palm: Hapus record palm format lama (beserta file gambarnya)
+            alih-alih menyimpannya untuk registrasi ulang.
+
+    Returns:
+        tuple: (jumlah wajah yang dikonversi, jumlah palm lama yang ditandai/dihapus)
+    """
+    # Import lokal: embedding_cache sendiri memakai helper dari modul ini
+    from app.services.embedding_cache import bump_generation
+
+    _ensure_binary_column()
+
+    rows = db.session.execute(
+        select(
+            BiometricData.id, BiometricData.biometric_type,
+            BiometricData.image_path, raw_embedding_column()
+        )
+    ).all()
+
+    faces = palms = 0
+    removed_files = []
+    for record_id, biometric_type, image_path, value in rows:
+        legacy = _parse_legacy(value)
+        if legacy is None:
+            continue
+
+        if biometric_type == "face":
+            embedding = serialize_embedding(normalize_embedding(legacy))
+            db.session.execute(
+                update(BiometricData).where(BiometricData.id == record_id).values(embedding=embedding)
+            )
+            faces += 1
+            continue
+
+        palms += 1
+        if drop_palm:
+            removed_files.append(image_path)
+            db.session.execute(delete(BiometricData).where(BiometricData.id == record_id))
+        elif isinstance(value, str):
+            # Simpan sebagai bytes; deserialize_descriptors menolaknya dan meminta registrasi ulang
+            db.session.execute(
+                update(BiometricData).where(BiometricData.id == record_id).values(embedding=value.encode())
+            )
+
+    # Worker yang sedang berjalan memuat baris hasil konversi pada akses berikutnya
+    if faces:
+        bump_generation("face")
+    if palms:
+        bump_generation("palm")
+    db.session.commit()
+
+    # File gambar dihapus setelah commit agar tidak ada record yang kehilangan filenya
+    for image_path in removed_files:
+        if image_path and os.path.exists(image_path):
+            try:
+                os.remove(image_path)
+            except OSError as e:
+                logger.warning("Gagal menghapus file gambar: %s", str(e))
+    return faces, palms
@@ -0,0 +1,179 @@
+"""
+Face Detector
+==============
+Deteksi kotak wajah yang dipakai bersama oleh service wajah.
+Menggunakan YuNet (cv2.FaceDetectorYN, CNN ONNX di backend DNN OpenCV)
+dan jatuh ke Haar cascade jika model YuNet tidak tersedia.
+Detector dimuat sekali per worker, bukan per request.
+"""
+
+import logging
+import threading
+import cv2
+import numpy as np
+from flask import current_app
+
+from app.utils.download import download_file_if_not_exists
+
+logger = logging.getLogger(__name__)
+
+# Global variables to cache the detectors
+_face_cascade = None
+_yunet = None
+_yunet_failed = False
+
+# Sisi terpanjang gambar saat deteksi Haar; resolusi di atas ini hanya menambah kerja per skala
+_HAAR_MAX_DIM = 640
+
+# setInputSize + detect pada FaceDetectorYN harus atomik
+_yunet_lock = threading.Lock()
+
+# Pemuatan (dan unduhan) model YuNet cukup dilakukan satu thread
+_yunet_load_lock = threading.Lock()
+
+
+def get_face_cascade() -> cv2.CascadeClassifier:
+    """Mendapatkan Haar cascade wajah frontal, meload XML cuma sekali."""
+    global _face_cascade
+    if _face_cascade is None:
+        _face_cascade = cv2.CascadeClassifier(
+            cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
+        )
+    return _face_cascade
+
+
+def _get_yunet():
+    """Mendapatkan detector YuNet, meload (dan mengunduh) model cuma sekali. None jika tidak tersedia."""
+    global _yunet, _yunet_failed
+    if _yunet is not None or _yunet_failed:
+        return _yunet
+    with _yunet_load_lock:
+        if _yunet is None and not _yunet_failed:
+            model_path = current_app.config.get("FACE_DETECTOR_MODEL_PATH")
+            model_url = current_app.config.get("FACE_DETECTOR_MODEL_URL")
+            try:
+                if model_url:
+                    download_file_if_not_exists(model_url, model_path)
+                _yunet = cv2.FaceDetectorYN.create(model_path, "", (320, 320), 0.9, 0.3, 5000)
+                logger.info("Detector wajah YuNet dimuat dari %s", model_path)
+            except Exception as e:
+                logger.warning("YuNet tidak tersedia, memakai Haar cascade: %s", str(e))
+                _yunet_failed = True
+    return _yunet
+
+
+def _detect_yunet(detector, image: np.ndarray) -> tuple[tuple[int, int, int, int], np.ndarray] | None:
+    """
+    Deteksi wajah terbesar dengan YuNet (input BGR langsung, tanpa konversi grayscale).
+
+    Returns:
+        tuple: ((x, y, w, h), eyes) dengan eyes berisi koordinat mata kanan dan kiri
+        (sudut pandang subjek), atau None jika tidak ada wajah.
+    """
+    if image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+
+    img_h, img_w = image.shape[:2]
+    with _yunet_lock:
+        detector.setInputSize((img_w, img_h))
+        _, faces = detector.detect(image)
+
+    if faces is None or len(faces) == 0:
+        return None
+
+    # Kolom 0-3 adalah kotak (x, y, w, h), kolom 4-13 lima landmark: mata kanan, mata kiri,
+    # hidung, ujung mulut kanan, ujung mulut kiri; koordinat bisa keluar batas gambar
+    face = max(faces, key=lambda row: row[2] * row[3])
+    x, y, w, h = face[:4]
+    x1, y1 = max(0, int(x)), max(0, int(y))
+    x2, y2 = min(img_w, int(x + w)), min(img_h, int(y + h))
+    if x2 <= x1 or y2 <= y1:
+        return None
+    return (x1, y1, x2 - x1, y2 - y1), face[4:8].reshape(2, 2)
+
+
+def _detect_haar(image: np.ndarray) -> tuple[int, int, int, int] | None:
+    """
+    Deteksi wajah terbesar dengan Haar cascade.
+    Gambar besar diperkecil dulu ke sisi terpanjang _HAAR_MAX_DIM sebelum konversi
+    grayscale, lalu kotak hasil deteksi diskalakan kembali ke koordinat asli.
+    """
+    scale = _HAAR_MAX_DIM / max(image.shape[:2])
+    if scale < 1.0:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    else:
+        scale = 1.0
+
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    min_size = max(1, round(60 * scale))
+    faces = get_face_cascade().detectMultiScale(
+        gray,
+        scaleFactor=1.1,
+        minNeighbors=5,
+        minSize=(min_size, min_size)
+    )
+
+    if len(faces) == 0:
+        return None
+
+    x, y, w, h = max(faces, key=lambda rect: rect[2] * rect[3])
+    return int(x / scale), int(y / scale), int(w / scale), int(h / scale)
+
+
+def detect_largest_face(image: np.ndarray) -> tuple[int, int, int, int] | None:
+    """
+    Mendeteksi wajah terbesar (paling depan) pada gambar BGR.
+
+    Returns:
+        tuple: (x, y, w, h) kotak wajah, atau None jika tidak ada wajah.
+    """
+    detector = _get_yunet()
+    if detector is not None:
+        detected = _detect_yunet(detector, image)
+        return detected[0] if detected is not None else None
+    return _detect_haar(image)
+
+
+def _align_crop(image: np.ndarray, box: tuple[int, int, int, int], eyes: np.ndarray) -> np.ndarray:
+    """
+    Memotong kotak wajah sambil memutar gambar di sekitar pusat kotak agar garis
+    kedua mata horizontal (sudut sama dengan alignment DeepFace berbasis posisi mata).
+    """
+    x, y, w, h = box
+    (right_x, right_y), (left_x, left_y) = eyes
+    angle = float(np.degrees(np.arctan2(left_y - right_y, left_x - right_x)))
+
+    # Rotasi di pusat kotak lalu digeser sehingga hasil warpAffine langsung berukuran crop
+    cx, cy = x + w / 2, y + h / 2
+    matrix = cv2.getRotationMatrix2D((cx, cy), angle, 1.0)
+    matrix[0, 2] += w / 2 - cx
+    matrix[1, 2] += h / 2 - cy
+    return cv2.warpAffine(
+        image, matrix, (w, h), flags=cv2.INTER_LINEAR,
+        borderMode=cv2.BORDER_CONSTANT, borderValue=0
+    )
+
+
+def detect_aligned_face(image: np.ndarray) -> np.ndarray | None:
+    """
+    Mendeteksi wajah terbesar pada gambar BGR dan mengembalikan crop wajah yang sudah
+    di-align berdasarkan posisi mata (input model embedding).
+    Haar cascade tidak menghasilkan landmark, sehingga pada fallback tersebut crop
+    dikembalikan tanpa alignment.
+
+    Returns:
+        np.ndarray: Crop wajah BGR, atau None jika tidak ada wajah.
+    """
+    detector = _get_yunet()
+    if detector is None:
+        box = _detect_haar(image)
+        if box is None:
+            return None
+        x, y, w, h = box
+        return image[y:y + h, x:x + w]
+
+    detected = _detect_yunet(detector, image)
+    if detected is None:
+        return None
+    box, eyes = detected
+    return _align_crop(image, box, eyes)
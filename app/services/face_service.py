@@ -1,20 +1,210 @@
 """
 Face Recognition Service
 =========================
-Menggunakan DeepFace untuk ekstraksi embedding wajah
-dan perbandingan (cosine similarity).
+Menggunakan DeepFace (atau model ONNX hasil export jika dikonfigurasi)
+untuk ekstraksi embedding wajah dan perbandingan (cosine similarity).
 """
 
-import json
+import os
 import logging
+import cv2
 import numpy as np
+import onnxruntime as ort
 from deepface import DeepFace
-from flask import current_app
+
+from app.services._kernels import cosine_distances
+from app.services.face_detector import detect_aligned_face
 
 logger = logging.getLogger(__name__)
 
+# Global variable to cache the ONNX session model embedding wajah
+_face_session = None
+
+# Model DeepFace yang sudah dibangun (dipakai jika tidak ada model ONNX)
+_face_model = None
+
+# Konfigurasi statis, dibaca sekali saat aplikasi dibuat (lihat init_face_session)
+_model_name = "VGG-Face"
+_threshold = 0.40
+
+# Faktor kuantisasi int8 untuk vektor unit-norm (komponen selalu dalam [-1, 1])
+_INT8_SCALE = 127.0
+
+# Hasil deteksi GPU OpenCV-CUDA (None = belum dicek)
+_cuda_enabled = None
+
+
+def _use_cuda() -> bool:
+    """Mengecek sekali apakah OpenCV dibangun dengan CUDA dan ada GPU yang tersedia."""
+    global _cuda_enabled
+    if _cuda_enabled is None:
+        try:
+            _cuda_enabled = cv2.cuda.getCudaEnabledDeviceCount() > 0
+        except (AttributeError, cv2.error):
+            _cuda_enabled = False
+        if _cuda_enabled:
+            logger.info("OpenCV CUDA terdeteksi, preprocessing wajah dijalankan di GPU")
+    return _cuda_enabled
+
+
+def init_face_session(app):
+    """
+    Memuat model embedding wajah sekali saat aplikasi dibuat.
+    Jika FACE_ONNX_MODEL_PATH tidak diisi, model DeepFace dibangun sekali
+    di sini dan dipanggil langsung per request.
+    """
+    global _face_session, _model_name, _threshold
+    _model_name = app.config.get("FACE_MODEL", "VGG-Face")
+    _threshold = app.config.get("FACE_THRESHOLD", 0.40)
+
+    model_path = app.config.get("FACE_ONNX_MODEL_PATH")
+    if not model_path:
+        _build_deepface_model()
+        return
+    if not os.path.exists(model_path):
+        logger.warning("Model ONNX wajah tidak ditemukan di %s, memakai DeepFace", model_path)
+        _build_deepface_model()
+        return
+
+    opts = ort.SessionOptions()
+    opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    opts.intra_op_num_threads = app.config.get("FACE_ONNX_THREADS", 0)
+
+    providers = ["CPUExecutionProvider"]
+    if "CUDAExecutionProvider" in ort.get_available_providers():
+        providers.insert(0, "CUDAExecutionProvider")
+
+    logger.info("Memuat model ONNX wajah dari %s (%s)...", model_path, ", ".join(providers))
+    _face_session = ort.InferenceSession(model_path, sess_options=opts, providers=providers)
+
+
+def _build_deepface_model():
+    """Membangun model DeepFace (meload bobot) sekali per worker."""
+    global _face_model
+    logger.info("Memuat model DeepFace %s...", _model_name)
+    try:
+        _face_model = DeepFace.build_model(_model_name)
+    except Exception as e:
+        # Tetap bisa melayani request lewat DeepFace.represent (model dimuat saat dipakai)
+        logger.error("Gagal memuat model DeepFace %s: %s", _model_name, str(e))
+
+
+def face_threshold() -> float:
+    """Batas maksimal cosine distance wajah yang dibaca dari config saat startup."""
+    return _threshold
+
+
+def _forward_deepface(face: np.ndarray) -> np.ndarray:
+    """
+    Menjalankan model DeepFace langsung pada crop wajah BGR, tanpa
+    plumbing DeepFace.represent (load gambar, deteksi, validasi argumen).
+    Preprocessing sama dengan jalur ONNX (lihat _preprocess_face).
+    """
+    # input_shape DeepFace berformat (width, height)
+    width, height = _face_model.input_shape
+    tensor = _preprocess_face(face, [1, height, width, 3])
+    return np.asarray(_face_model.forward(tensor[np.newaxis, ...]), dtype=np.float32).reshape(-1)
+
+
+def _input_layout(input_shape: list) -> tuple[bool, int, int]:
+    """Membaca (channels_first, height, width) dari shape input model ONNX."""
+    channels_first = input_shape[1] == 3
+    height, width = input_shape[2:4] if channels_first else input_shape[1:3]
+    if not isinstance(height, int) or not isinstance(width, int):
+        height, width = 224, 224
+    return channels_first, height, width
+
+
+def _preprocess_face(face: np.ndarray, input_shape: list) -> np.ndarray:
+    """
+    Menyiapkan crop wajah BGR sesuai preprocessing DeepFace.represent (detector
+    opencv): resize dengan menjaga rasio + padding hitam, lalu skala 0-1.
+    Urutan channel tetap BGR, sama dengan input model di DeepFace.represent.
+    Dipakai bersama oleh jalur ONNX dan DeepFace agar embedding konsisten.
+
+    Returns:
+        np.ndarray: Tensor float32 tanpa batch dimension (HWC atau CHW sesuai model).
+    """
+    channels_first, height, width = _input_layout(input_shape)
+
+    h, w = face.shape[:2]
+    factor = min(height / h, width / w)
+    resized = cv2.resize(face, (max(1, int(w * factor)), max(1, int(h * factor))))
+
+    canvas = np.zeros((height, width, 3), dtype=np.float32)
+    top = (height - resized.shape[0]) // 2
+    left = (width - resized.shape[1]) // 2
+    canvas[top:top + resized.shape[0], left:left + resized.shape[1]] = resized
+    canvas /= 255.0
+
+    return canvas.transpose(2, 0, 1) if channels_first else canvas
+
+
+def _preprocess_face_gpu(face: np.ndarray, input_shape: list) -> np.ndarray:
+    """
+    Versi GPU dari _preprocess_face: resize, padding, dan konversi float32
+    dijalankan di satu cv2.cuda_Stream, hanya hasil akhir yang di-download.
+    """
+    channels_first, height, width = _input_layout(input_shape)
+
+    h, w = face.shape[:2]
+    factor = min(height / h, width / w)
+    new_w, new_h = max(1, int(w * factor)), max(1, int(h * factor))
+    top = (height - new_h) // 2
+    left = (width - new_w) // 2
+
+    stream = cv2.cuda_Stream()
+    gpu_face = cv2.cuda_GpuMat()
+    gpu_face.upload(np.ascontiguousarray(face), stream=stream)
+    gpu_resized = cv2.cuda.resize(gpu_face, (new_w, new_h), stream=stream)
+    gpu_padded = cv2.cuda.copyMakeBorder(
+        gpu_resized, top, height - new_h - top, left, width - new_w - left,
+        cv2.BORDER_CONSTANT, value=(0, 0, 0), stream=stream
+    )
+    gpu_scaled = gpu_padded.convertTo(rtype=cv2.CV_32FC3, alpha=1.0 / 255.0, beta=0.0, stream=stream)
+    canvas = gpu_scaled.download(stream=stream)
+    stream.waitForCompletion()
 
-def extract_face_embedding(image_data: str | np.ndarray) -> list | None:
+    return canvas.transpose(2, 0, 1) if channels_first else canvas
+
+
+def represent_batch(images: list[np.ndarray]) -> list[np.ndarray | None]:
+    """
+    Mengekstrak embedding beberapa gambar wajah BGR dengan satu forward pass ONNX.
+
+    Returns:
+        list: Embedding float32 per gambar, None untuk gambar tanpa wajah.
+    """
+    session = _face_session
+    model_input = session.get_inputs()[0]
+
+    preprocess = _preprocess_face_gpu if _use_cuda() else _preprocess_face
+
+    results = [None] * len(images)
+    indices, tensors = [], []
+    for i, image in enumerate(images):
+        face = detect_aligned_face(image) if image is not None else None
+        if face is None:
+            continue
+        indices.append(i)
+        tensors.append(preprocess(face, model_input.shape))
+
+    if not tensors:
+        return results
+
+    batch = np.stack(tensors)
+    if model_input.shape[0] == 1:
+        # Model diexport dengan batch dimension tetap, jalankan satu per satu
+        outputs = [session.run(None, {model_input.name: batch[i:i + 1]})[0][0] for i in range(len(batch))]
+    else:
+        outputs = session.run(None, {model_input.name: batch})[0]
+
+    for i, embedding in zip(indices, outputs):
+        results[i] = np.asarray(embedding, dtype=np.float32)
+    return results
+
+
+def extract_face_embedding(image_data: str | np.ndarray) -> np.ndarray | None:
     """
     Mengekstrak embedding vector dari gambar wajah.
 
@@ -22,24 +212,39 @@ def extract_face_embedding(image_data: str | np.ndarray) -> list | None:
         image_data: Path absolut ke file gambar wajah string ATAU numpy array gambar.
 
     Returns:
-        list: Embedding vector sebagai list float, atau None jika gagal.
+        np.ndarray: Embedding vector float32, atau None jika gagal.
     """
     try:
-        model_name = current_app.config.get("FACE_MODEL", "VGG-Face")
-        
-        # DeepFace.represent handles both path string and numpy array in 'img_path'
-        # enforce_detection=True ensures we reject images without a clear face (e.g. palm, object)
-        # Menggunakan backend 'opencv' (Haar Cascades) untuk KECEPATAN (Akses Pintu Harian).
-        # Ini jauh lebih ringan di CPU dibanding RetinaFace, waktu respons bisa turun ke ~1-2 detik.
+        if _face_session is not None:
+            image = cv2.imread(image_data) if isinstance(image_data, str) else image_data
+            embedding = represent_batch([image])[0]
+            if embedding is None:
+                logger.warning("Tidak ada wajah terdeteksi pada gambar")
+                return None
+            logger.info("Berhasil mengekstrak embedding wajah (ONNX): %d dimensi", len(embedding))
+            return embedding
+
+        # Deteksi dengan YuNet (atau Haar jika YuNet tidak tersedia), crop wajah yang sudah
+        # di-align diberikan ke model sehingga semua jalur memakai preprocessing dan urutan channel yang sama
+        image = cv2.imread(image_data) if isinstance(image_data, str) else image_data
+        face = detect_aligned_face(image) if image is not None else None
+        if face is None:
+            logger.warning("Tidak ada wajah terdeteksi pada gambar")
+            return None
+        if _face_model is not None:
+            embedding = _forward_deepface(face)
+            logger.info("Berhasil mengekstrak embedding wajah: %d dimensi", len(embedding))
+            return embedding
+        # represent(skip) membalik urutan channel input, crop dibalik dulu agar model tetap menerima BGR
         embeddings = DeepFace.represent(
-            img_path=image_data,
-            model_name=model_name,
-            enforce_detection=True,
-            detector_backend="opencv"
+            img_path=face[:, :, ::-1],
+            model_name=_model_name,
+            enforce_detection=False,
+            detector_backend="skip"
         )
 
         if embeddings and len(embeddings) > 0:
-            embedding = embeddings[0]["embedding"]
+            embedding = np.asarray(embeddings[0]["embedding"], dtype=np.float32)
             logger.info(
                 "Berhasil mengekstrak embedding wajah: %d dimensi",
                 len(embedding)
@@ -55,16 +260,17 @@ def extract_face_embedding(image_data: str | np.ndarray) -> list | None:
 
 
 def compare_face_embeddings(
-    input_embedding: list,
-    stored_embedding_json: str,
+    input_embedding: np.ndarray,
+    stored_embedding: bytes,
     threshold: float | None = None
 ) -> tuple[bool, float]:
     """
     Membandingkan dua embedding wajah menggunakan cosine similarity.
+    Kedua embedding diasumsikan sudah dinormalisasi (lihat normalize_embedding).
 
     Args:
         input_embedding: Embedding dari gambar input.
-        stored_embedding_json: JSON string embedding tersimpan di database.
+        stored_embedding: Bytes float32 embedding tersimpan di database.
         threshold: Batas minimal similarity (opsional, ambil dari config).
 
     Returns:
@@ -72,25 +278,17 @@ def compare_face_embeddings(
     """
     try:
         if threshold is None:
-            threshold = current_app.config.get("FACE_THRESHOLD", 0.40)
+            threshold = _threshold
 
-        stored_embedding = json.loads(stored_embedding_json)
+        # float32 end-to-end (sama dengan output model), tanpa upcast ke float64
+        vec_a = np.asarray(input_embedding, dtype=np.float32)
+        vec_b = deserialize_embedding(stored_embedding)
 
-        vec_a = np.array(input_embedding, dtype=np.float64)
-        vec_b = np.array(stored_embedding, dtype=np.float64)
-
-        # Cosine similarity
-        dot_product = np.dot(vec_a, vec_b)
-        norm_a = np.linalg.norm(vec_a)
-        norm_b = np.linalg.norm(vec_b)
-
-        if norm_a == 0 or norm_b == 0:
-            return False, 0.0
-
-        cosine_similarity = dot_product / (norm_a * norm_b)
+        # Kedua embedding sudah unit-norm, cosine similarity = dot product
+        cosine_similarity = np.dot(vec_a, vec_b)
 
         # Cosine distance (DeepFace menggunakan cosine distance)
-        cosine_distance = 1.0 - cosine_similarity
+        cosine_distance = float(np.float32(1.0) - cosine_similarity)
 
         is_match = cosine_distance <= threshold
 
@@ -106,6 +304,75 @@ def compare_face_embeddings(
         return False, 1.0
 
 
-def serialize_embedding(embedding: list) -> str:
-    """Mengubah embedding vector menjadi JSON string untuk disimpan di database."""
-    return json.dumps(embedding)
+def normalize_embedding(embedding: np.ndarray) -> np.ndarray:
+    """Menormalisasi embedding ke panjang 1 agar cosine similarity cukup dengan dot product."""
+    vec = np.array(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vec)
+    if norm > 0:
+        vec /= norm
+    return vec
+
+
+def quantize_embeddings(embeddings: np.ndarray, precision: str = "float32") -> np.ndarray:
+    """
+    Mengubah embedding unit-norm ke presisi penyimpanan di memori.
+
+    Args:
+        embeddings: Embedding (D,) atau matriks (N, D) float32 unit-norm.
+        precision: 'float32', 'float16' (2x lebih kecil), atau 'int8' (4x lebih kecil).
+    """
+    if precision == "int8":
+        return np.round(np.asarray(embeddings, dtype=np.float32) * _INT8_SCALE).astype(np.int8)
+    if precision == "float16":
+        return np.asarray(embeddings, dtype=np.float16)
+    return np.asarray(embeddings, dtype=np.float32)
+
+
+def find_best_face_match(
+    input_embedding: np.ndarray,
+    matrix: np.ndarray,
+    threshold: float | None = None
+) -> tuple[int | None, float]:
+    """
+    Mencari embedding terdekat dari seluruh matriks dengan satu perkalian matriks.
+
+    Args:
+        input_embedding: Embedding unit-norm dari gambar input.
+        matrix: Matriks (N, D) embedding tersimpan yang sudah dinormalisasi L2
+            (float32, atau hasil quantize_embeddings).
+        threshold: Batas maksimal cosine distance (opsional, ambil dari config).
+
+    Returns:
+        tuple: (index baris terbaik atau None, cosine_distance)
+    """
+    if threshold is None:
+        threshold = _threshold
+
+    if matrix.shape[0] == 0:
+        return None, 0.0
+
+    # Cosine distance ke seluruh baris sekaligus (kernel Numba atau satu panggilan BLAS)
+    # Query tetap float32, matriks int8 dikembalikan ke skala aslinya lewat scale
+    scale = 1.0 / _INT8_SCALE if matrix.dtype == np.int8 else 1.0
+    distances = cosine_distances(np.asarray(input_embedding, dtype=np.float32), matrix, scale)
+    idx = int(np.argmin(distances))
+    best_distance = float(distances[idx])
+
+    logger.debug(
+        "Pencarian wajah batch - %d kandidat, distance terbaik: %.4f, threshold: %.4f",
+        matrix.shape[0], best_distance, threshold
+    )
+
+    if best_distance <= threshold:
+        return idx, best_distance
+    return None, 0.0
+
+
+def serialize_embedding(embedding: np.ndarray) -> bytes:
+    """Mengubah embedding vector menjadi bytes float32 untuk disimpan di database."""
+    return np.asarray(embedding, dtype=np.float32).tobytes()
+
+
+def deserialize_embedding(buf: bytes) -> np.ndarray:
+    """Mengubah bytes dari database kembali menjadi embedding float32 (tanpa copy)."""
+    return np.frombuffer(buf, dtype=np.float32)
@@ -7,23 +7,39 @@ Menggunakan model ringan MiniFASNet format ONNX.
 """
 
 import os
+import math
 import cv2
 import numpy as np
 import logging
-import requests
 import onnxruntime as ort
 from flask import current_app
 
+from app.services.face_detector import detect_largest_face
+from app.utils.download import download_file_if_not_exists
+
 logger = logging.getLogger(__name__)
 
 # Global variable to cache the ONNX session
 _ort_session = None
 
 def _get_liveness_model_path():
-    """Mengambil path model dari config dan memastikan foldernya ada."""
-    model_path = current_app.config.get("LIVENESS_MODEL_PATH")
-    os.makedirs(os.path.dirname(model_path), exist_ok=True)
-    return model_path
+    """Mengambil path model dari config (foldernya dibuat saat aplikasi dibuat)."""
+    return current_app.config.get("LIVENESS_MODEL_PATH")
+
+def _int8_model_path(model_path: str) -> str:
+    """Path model hasil kuantisasi INT8, contoh: liveness.onnx -> liveness_int8.onnx."""
+    root, ext = os.path.splitext(model_path)
+    return f"{root}_int8{ext}"
+
+
+def _optimized_model_path(optimized_path: str, source_path: str) -> str:
+    """
+    Path cache graph teroptimasi untuk model sumber tertentu, contoh:
+    liveness_optimized.onnx + liveness_int8.onnx -> liveness_optimized_liveness_int8.onnx.
+    """
+    root, ext = os.path.splitext(optimized_path)
+    source_name = os.path.splitext(os.path.basename(source_path))[0]
+    return f"{root}_{source_name}{ext}"
 
 def download_model_if_not_exists():
     """Mengunduh model ONNX jika belum ada di server."""
@@ -35,11 +51,8 @@ def download_model_if_not_exists():
 
     logger.info(f"Mengunduh model Liveness Anti-Spoofing dari {model_url}...")
     try:
-        response = requests.get(model_url, timeout=30)
-        response.raise_for_status()
-        with open(model_path, "wb") as f:
-            f.write(response.content)
-        logger.info(f"Model berhasil diunduh dan disimpan di {model_path}")
+        # Di-stream per potongan ke disk, tidak ditampung utuh di memori
+        download_file_if_not_exists(model_url, model_path)
     except Exception as e:
         logger.error(f"Gagal mengunduh model Liveness: {e}")
         raise
@@ -50,14 +63,105 @@ def _get_ort_session():
     if _ort_session is None:
         download_model_if_not_exists()
         model_path = _get_liveness_model_path()
+
+        # Gunakan model INT8 (hasil `flask quantize-liveness`) jika tersedia
+        if os.path.exists(_int8_model_path(model_path)):
+            model_path = _int8_model_path(model_path)
         logger.info(f"Memuat model ONNX Liveness dari {model_path}...")
         
+        # Optimasi graph penuh (fusi conv/bn/relu ke kernel MLAS), eksekusi sekuensial
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        opts.intra_op_num_threads = current_app.config.get("LIVENESS_ONNX_THREADS", 0)
+
+        # Graph hasil optimasi disimpan agar startup berikutnya tidak perlu mengoptimasi ulang.
+        # Cache terikat ke model sumbernya dan dibuat ulang jika model sumber lebih baru.
+        optimized_path = current_app.config.get("LIVENESS_OPTIMIZED_MODEL_PATH")
+        tmp_path = None
+        if optimized_path:
+            optimized_path = _optimized_model_path(optimized_path, model_path)
+            if os.path.exists(optimized_path) and os.path.getmtime(optimized_path) >= os.path.getmtime(model_path):
+                model_path = optimized_path
+            else:
+                tmp_path = f"{optimized_path}.{os.getpid()}.tmp"
+                opts.optimized_model_filepath = tmp_path
+        
         # Gunakan CPU Execution Provider untuk kompatibilitas docker universal dan kecepatan inferensi model < 10ms
         providers = ['CPUExecutionProvider']
-        _ort_session = ort.InferenceSession(model_path, providers=providers)
+        _ort_session = ort.InferenceSession(model_path, sess_options=opts, providers=providers)
+
+        # Ganti secara atomik agar worker lain tidak membaca file yang setengah tertulis
+        if tmp_path and os.path.exists(tmp_path):
+            os.replace(tmp_path, optimized_path)
+            logger.info(f"Graph liveness teroptimasi disimpan di {optimized_path}")
     
     return _ort_session
 
+# Ukuran input MiniFASNet 2.7_80x80 (width, height)
+_TARGET_SIZE = (80, 80)
+
+def _face_crop(image: np.ndarray) -> np.ndarray | None:
+    """
+    Memotong wajah terbesar (dengan padding) dan me-resize ke ukuran input MiniFASNet.
+
+    Returns:
+        np.ndarray: Crop wajah BGR uint8 80x80, atau None jika wajah tidak terdeteksi.
+    """
+    # Deteksi kotak wajah dengan detector CNN YuNet (input BGR langsung, tanpa grayscale),
+    # jatuh ke Haar cascade jika model YuNet tidak tersedia.
+    # Ini penting! Model liveness hanya bekerja jika inputnya benar-benar Wajah yang nge-pas, 
+    # bukan gambar 640x720 yg berisi tembok/pundak.
+    # Detector mengembalikan wajah yang paling besar (paling depan)
+    box = detect_largest_face(image)
+    
+    if box is None:
+        logger.warning("[Liveness] Wajah tidak terdeteksi untuk liveness crop.")
+        return None
+         
+    (x, y, w, h) = box
+
+    # Beri sedikit 'padding' (ruang dahi/dagu) agar MiniFASNet lebih akurat membaca depth
+    padding = int(w * 0.15)
+    
+    # Pastikan koordinat tidak melewati batas resolusi gambar
+    start_y = max(0, y - padding)
+    end_y = min(image.shape[0], y + h + padding)
+    start_x = max(0, x - padding)
+    end_x = min(image.shape[1], x + w + padding)
+    
+    # Lakukan pemotongan (Crop)
+    face_crop_bgr = image[start_y:end_y, start_x:end_x]
+
+    if face_crop_bgr.size == 0:
+        return None
+
+    # Pre-processing khusus sesuai standar input MiniFASNet 2.7_80x80
+    # Sesuaikan orientasi ke 80x80; INTER_AREA saat memperkecil (anti-aliasing),
+    # INTER_LINEAR jika crop lebih kecil dari target
+    if face_crop_bgr.shape[0] > _TARGET_SIZE[1] and face_crop_bgr.shape[1] > _TARGET_SIZE[0]:
+        interpolation = cv2.INTER_AREA
+    else:
+        interpolation = cv2.INTER_LINEAR
+    return cv2.resize(face_crop_bgr, _TARGET_SIZE, interpolation=interpolation)
+
+
+def _face_blob(image: np.ndarray) -> np.ndarray | None:
+    """
+    Menyiapkan crop wajah terbesar sebagai input MiniFASNet.
+
+    Returns:
+        np.ndarray: Blob float32 (1, 3, 80, 80), atau None jika wajah tidak terdeteksi.
+    """
+    img_resized = _face_crop(image)
+    if img_resized is None:
+        return None
+
+    # Konversi ke float32 + HWC -> NCHW (1, Channels, Height, Width) dalam satu panggilan C,
+    # hasilnya contiguous sehingga ONNX Runtime tidak perlu menyalin ulang
+    return cv2.dnn.blobFromImage(img_resized, 1.0, _TARGET_SIZE, swapRB=False, crop=False)
+
+
 def check_liveness(image: np.ndarray) -> tuple[bool, float]:
     """
     Memeriksa gambar apakah dari wajah manusia asli (Live) atau palsu (Spoof).
@@ -72,75 +176,25 @@ def check_liveness(image: np.ndarray) -> tuple[bool, float]:
         if image is None or image.size == 0:
             return False, 0.0
 
-        # Gunakan Haar Cascade OpenCV untuk deteksi kotak wajah super cepat
-        # Ini penting! Model liveness hanya bekerja jika inputnya benar-benar Wajah yang nge-pas, 
-        # bukan gambar 640x720 yg berisi tembok/pundak.
-        face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        
-        # Ubah gambar ke Grayscale untuk deteksi kordinat wajah
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        
-        # Cari wajah
-        faces = face_cascade.detectMultiScale(
-            gray,
-            scaleFactor=1.1,
-            minNeighbors=5,
-            minSize=(60, 60)
-        )
-        
-        if len(faces) == 0:
-             logger.warning("[Liveness] Wajah tidak terdeteksi untuk liveness crop.")
-             return False, 0.0
-             
-        # Ambil wajah yang paling besar (paling depan)
-        (x, y, w, h) = max(faces, key=lambda rect: rect[2] * rect[3])
-
-        # Beri sedikit 'padding' (ruang dahi/dagu) agar MiniFASNet lebih akurat membaca depth
-        padding = int(w * 0.15)
-        
-        # Pastikan koordinat tidak melewati batas resolusi gambar
-        start_y = max(0, y - padding)
-        end_y = min(image.shape[0], y + h + padding)
-        start_x = max(0, x - padding)
-        end_x = min(image.shape[1], x + w + padding)
-        
-        # Lakukan pemotongan (Crop)
-        face_crop_bgr = image[start_y:end_y, start_x:end_x]
-
-        if face_crop_bgr.size == 0:
+        img_np = _face_blob(image)
+        if img_np is None:
              return False, 0.0
 
         session = _get_ort_session()
 
-        # Pre-processing khusus sesuai standar input MiniFASNet 2.7_80x80
-        # Sesuaikan orientasi ke 80x80
-        target_size = (80, 80)
-        img_resized = cv2.resize(face_crop_bgr, target_size)
-    
-        # Normalisasi ke float32 (standar input AI vision)
-        img_np = np.array(img_resized, dtype=np.float32)
-
-        # HWC (Height, Width, Channels) to CHW (Channels, Height, Width)
-        img_np = np.transpose(img_np, (2, 0, 1))
-
-        # Tambahkan batch dimension: (1, Channels, Height, Width)
-        img_np = np.expand_dims(img_np, axis=0)
-
         # Dapatkan nama node input
         input_name = session.get_inputs()[0].name
 
         # Eksekusi Inferensi ONNX
         outputs = session.run(None, {input_name: img_np})
         
-        # Hasil model berupa list/array 2 elemen -> [SpoofProbability, RealProbability]
-        scores = outputs[0][0]
+        # Hasil model berupa logit per kelas; MiniFASNetV2 memiliki 3 kelas dengan index 1 = Asli (Real)
+        scores = outputs[0][0].tolist()
         
-        # Softmax untuk mendapatkan presentase kepastian 0.0 - 1.0
-        exp_scores = np.exp(scores)
-        probabilities = exp_scores / np.sum(exp_scores)
-        
-        # Index 1 adalah probabilitas kriteria Asli (Real)
-        real_score = float(probabilities[1])
+        # Softmax index 1 dihitung sebagai skalar tanpa alokasi array numpy.
+        # Dikurangi logit maksimum agar math.exp tidak overflow
+        max_score = max(scores)
+        real_score = math.exp(scores[1] - max_score) / sum(math.exp(v - max_score) for v in scores)
         is_real = real_score >= threshold
         
         logger.debug(f"[Liveness Check] Skor Real: {real_score:.4f} | Lulus: {is_real}")
@@ -150,3 +204,107 @@ def check_liveness(image: np.ndarray) -> tuple[bool, float]:
         logger.error(f"Error saat liveness inference check: {e}")
         return False, 0.0
 
+
+def check_liveness_batch(images: list[np.ndarray]) -> list[tuple[bool, float]]:
+    """
+    Versi batch dari check_liveness: seluruh crop wajah dijalankan dalam satu
+    inferensi ONNX (model MiniFASNet memiliki batch dimension dinamis).
+
+    Returns:
+        list: (is_real_human, liveness_score_0_to_1) per gambar, sesuai urutan input.
+        Gambar tanpa wajah bernilai (False, 0.0).
+    """
+    results = [(False, 0.0)] * len(images)
+    try:
+        threshold = current_app.config.get("LIVENESS_THRESHOLD", 0.80)
+
+        indices, crops = [], []
+        for i, image in enumerate(images):
+            if image is None or image.size == 0:
+                continue
+            crop = _face_crop(image)
+            if crop is not None:
+                indices.append(i)
+                crops.append(crop)
+
+        if not crops:
+            return results
+
+        session = _get_ort_session()
+        input_name = session.get_inputs()[0].name
+
+        # (N, 3, 80, 80) float32 contiguous dalam satu panggilan C
+        batch = cv2.dnn.blobFromImages(crops, 1.0, _TARGET_SIZE, swapRB=False, crop=False)
+        logits = session.run(None, {input_name: batch})[0]
+
+        # Softmax per baris (stabil dengan pengurangan maksimum), index 1 = Asli (Real)
+        exp_logits = np.exp(logits - logits.max(axis=1, keepdims=True))
+        real_scores = exp_logits[:, 1] / exp_logits.sum(axis=1)
+
+        for i, real_score in zip(indices, real_scores.tolist()):
+            results[i] = (real_score >= threshold, real_score)
+
+        logger.debug(f"[Liveness Batch] {len(crops)}/{len(images)} wajah diperiksa")
+        return results
+
+    except Exception as e:
+        logger.error(f"Error saat liveness batch inference check: {e}")
+        return [(False, 0.0)] * len(images)
+
+
+def quantize_model(image_paths: list[str]) -> tuple[str, int]:
+    """
+    Mengkuantisasi model liveness ke INT8 (statis, format QDQ, per-channel)
+    dengan kalibrasi dari crop wajah gambar yang sudah terdaftar.
+
+    Returns:
+        tuple: (path model INT8, jumlah gambar kalibrasi yang dipakai)
+
+    Raises:
+        ValueError: Jika tidak ada wajah yang bisa dipakai untuk kalibrasi.
+    """
+    # Tooling kuantisasi (butuh paket onnx) hanya diimport saat perintah CLI dijalankan
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    class _CalibrationReader(CalibrationDataReader):
+        """Memberikan blob wajah satu per satu ke kalibrasi kuantisasi statis."""
+
+        def __init__(self, input_name: str, blobs: list[np.ndarray]):
+            self._batches = iter([{input_name: blob} for blob in blobs])
+
+        def get_next(self):
+            return next(self._batches, None)
+
+    download_model_if_not_exists()
+    model_path = _get_liveness_model_path()
+    int8_path = _int8_model_path(model_path)
+
+    blobs = []
+    for path in image_paths:
+        image = cv2.imread(path)
+        blob = _face_blob(image) if image is not None else None
+        if blob is not None:
+            blobs.append(blob)
+    if not blobs:
+        raise ValueError("Tidak ada gambar wajah untuk kalibrasi kuantisasi")
+
+    input_name = ort.InferenceSession(model_path, providers=['CPUExecutionProvider']).get_inputs()[0].name
+    prepared_path = f"{int8_path}.{os.getpid()}.pre.onnx"
+    try:
+        quant_pre_process(model_path, prepared_path, skip_symbolic_shape=True)
+        quantize_static(
+            prepared_path,
+            int8_path,
+            _CalibrationReader(input_name, blobs),
+            quant_format=QuantFormat.QDQ,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            per_channel=True,
+        )
+    finally:
+        if os.path.exists(prepared_path):
+            os.remove(prepared_path)
+
+    logger.info(f"Model liveness INT8 disimpan di {int8_path} ({len(blobs)} gambar kalibrasi)")
+    return int8_path, len(blobs)
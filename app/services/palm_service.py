@@ -1,64 +1,109 @@
 """
 Palm Vein Recognition Service
 ==============================
-Menggunakan OpenCV ORB feature extraction dan BFMatcher
+Menggunakan OpenCV ORB feature extraction dan FLANN (index LSH)
 untuk mencocokkan pola vena telapak tangan dari gambar hitam-putih.
 """
 
-import json
 import logging
+import struct
+import threading
 import cv2
 import numpy as np
-from deepface import DeepFace
-from flask import current_app
+
+from app.services.face_detector import get_face_cascade
 
 logger = logging.getLogger(__name__)
 
+# Header 5 byte (versi uint8, rows, cols uint16 little-endian) sebelum data deskriptor mentah
+_DESCRIPTOR_HEADER = struct.Struct("<BHH")
+# Versi 2: deskriptor dari grayscale CLAHE tanpa blur/threshold. Template versi
+# sebelumnya (termasuk format lama tanpa byte versi) tidak kompatibel dan ditolak.
+_DESCRIPTOR_VERSION = 2
+
+# Konfigurasi statis, dibaca sekali saat aplikasi dibuat (lihat init_palm_service)
+_n_features = 1000
+_match_threshold = 0.15
+
+# ORB, matcher, dan CLAHE dibuat sekali per thread (objek OpenCV ini menyimpan
+# buffer internal sehingga tidak aman dipakai bersamaan oleh beberapa thread)
+_local = threading.local()
+
+# Parameter index LSH FLANN (algorithm=6 = FLANN_INDEX_LSH)
+_FLANN_LSH_PARAMS = dict(algorithm=6, table_number=6, key_size=12, multi_probe_level=1)
+
+
+def init_palm_service(app):
+    """Membaca konfigurasi ORB dan threshold palm sekali saat aplikasi dibuat."""
+    global _n_features, _match_threshold
+    _n_features = app.config.get("PALM_ORB_FEATURES", 1000)
+    _match_threshold = app.config.get("PALM_MATCH_THRESHOLD", 0.15)
+
+
+def _get_orb() -> cv2.ORB:
+    """Mendapatkan ORB detector milik thread ini."""
+    orb = getattr(_local, "orb", None)
+    if orb is None:
+        orb = _local.orb = cv2.ORB_create(nfeatures=_n_features)
+    return orb
+
 
-def _preprocess_image(image_data: str | np.ndarray) -> np.ndarray | None:
+def _get_matcher() -> cv2.DescriptorMatcher:
+    """Mendapatkan FLANN matcher dengan index LSH (untuk deskriptor biner ORB) milik thread ini."""
+    matcher = getattr(_local, "matcher", None)
+    if matcher is None:
+        matcher = _local.matcher = cv2.FlannBasedMatcher(_FLANN_LSH_PARAMS, {})
+    return matcher
+
+
+def _get_clahe() -> cv2.CLAHE:
+    """Mendapatkan objek CLAHE milik thread ini."""
+    clahe = getattr(_local, "clahe", None)
+    if clahe is None:
+        clahe = _local.clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
+    return clahe
+
+
+def _load_grayscale(image_data: str | np.ndarray) -> np.ndarray | None:
     """
-    Memproses gambar vena menjadi format optimal untuk ekstraksi fitur.
+    Membaca gambar sebagai grayscale.
 
     Args:
         image_data: Path ke file gambar (str) ATAU numpy array gambar (np.ndarray).
 
+    Returns:
+        np.ndarray: Gambar grayscale, atau None jika gagal.
+    """
+    if isinstance(image_data, str):
+        img = cv2.imread(image_data, cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            logger.error("Tidak dapat membaca gambar: %s", image_data)
+        return img
+    if isinstance(image_data, np.ndarray):
+        # Jika gambar input berwarna (3 channel), convert ke grayscale
+        if len(image_data.shape) == 3:
+            return cv2.cvtColor(image_data, cv2.COLOR_BGR2GRAY)
+        return image_data
+    logger.error("Input gambar tidak valid (harus path atau numpy array)")
+    return None
+
+
+def _preprocess_image(img: np.ndarray) -> np.ndarray | None:
+    """
+    Memproses gambar vena (grayscale) menjadi format optimal untuk ekstraksi fitur.
+
     Returns:
         np.ndarray: Gambar grayscale yang sudah diproses, atau None jika gagal.
     """
     try:
-        if isinstance(image_data, str):
-            img = cv2.imread(image_data, cv2.IMREAD_GRAYSCALE)
-            if img is None:
-                logger.error("Tidak dapat membaca gambar: %s", image_data)
-                return None
-        elif isinstance(image_data, np.ndarray):
-            img = image_data
-            # Jika gambar input berwarna (3 channel), convert ke grayscale
-            if len(img.shape) == 3:
-                img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        else:
-            logger.error("Input gambar tidak valid (harus path atau numpy array)")
-            return None
-
         # Resize ke ukuran standar untuk konsistensi
         img = cv2.resize(img, (400, 400))
 
         # CLAHE (Contrast Limited Adaptive Histogram Equalization)
         # untuk meningkatkan kontras pola vena
-        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
-        img = clahe.apply(img)
-
-        # Gaussian blur untuk mengurangi noise
-        img = cv2.GaussianBlur(img, (5, 5), 0)
-
-        # Adaptive threshold untuk mempertegas pola vena
-        img = cv2.adaptiveThreshold(
-            img, 255,
-            cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-            cv2.THRESH_BINARY_INV,
-            blockSize=11,
-            C=2
-        )
+        # Hasilnya langsung dipakai ORB: FAST/BRIEF butuh gradien grayscale kontinu,
+        # sehingga tidak di-blur atau di-threshold menjadi biner
+        img = _get_clahe().apply(img)
 
         return img
 
@@ -79,35 +124,30 @@ def extract_palm_features(image_data: str | np.ndarray) -> np.ndarray | None:
         np.ndarray: Deskriptor ORB, atau None jika gagal atau jika WAJAH terdeteksi.
     """
     try:
+        # Gambar dibaca sebagai grayscale sekali, dipakai untuk cek wajah dan ekstraksi ORB
+        gray = _load_grayscale(image_data)
+        if gray is None:
+            return None
+
         # 1. Validasi Negatif: Pastikan BUKAN wajah
-        # Kita gunakan DeepFace untuk mendeteksi wajah.
+        # Haar cascade OpenCV langsung (sama dengan backend "opencv" DeepFace, tanpa import DeepFace).
         # Jika wajah terdeteksi -> Ini BUKAN palm -> Return None
-        try:
-            # Gunakan OpenCV untuk cek negatif (jauh lebih cepat dari RetinaFace)
-            DeepFace.extract_faces(
-                img_path=image_data, 
-                enforce_detection=True,
-                detector_backend="opencv"
-            )
+        faces = get_face_cascade().detectMultiScale(
+            gray,
+            scaleFactor=1.1,
+            minNeighbors=5,
+            minSize=(60, 60)
+        )
+        if len(faces) > 0:
             logger.warning("Falsafah Palm: Wajah terdeteksi dalam gambar palm. Ditolak.")
             return None
-        except ValueError:
-            # ValueError means "Face could not be detected" -> Good for Palm!
-            pass
-        except Exception as e:
-            # Ignore other errors during face check to avoid blocking valid palms on edge cases
-            logger.debug("Face check verify error (ignored): %s", str(e))
 
         # 2. Lanjut ke ekstraksi fitur Palm (ORB)
-        img = _preprocess_image(image_data)
+        img = _preprocess_image(gray)
         if img is None:
             return None
 
-        n_features = current_app.config.get("PALM_ORB_FEATURES", 1000)
-
-        # Inisialisasi ORB detector
-        orb = cv2.ORB_create(nfeatures=n_features)
-        keypoints, descriptors = orb.detectAndCompute(img, None)
+        keypoints, descriptors = _get_orb().detectAndCompute(img, None)
 
         if descriptors is None or len(keypoints) == 0:
             logger.warning(
@@ -131,16 +171,16 @@ def extract_palm_features(image_data: str | np.ndarray) -> np.ndarray | None:
 
 def compare_palm_features(
     input_descriptors: np.ndarray,
-    stored_descriptors_json: str,
+    stored_descriptors: bytes,
     threshold: float | None = None
 ) -> tuple[bool, float]:
     """
     Membandingkan deskriptor ORB dari dua gambar vena menggunakan
-    BFMatcher dengan Hamming distance.
+    FLANN (index LSH) dengan Hamming distance.
 
     Args:
         input_descriptors: Deskriptor dari gambar input.
-        stored_descriptors_json: JSON string deskriptor dari database.
+        stored_descriptors: Bytes deskriptor dari database.
         threshold: Batas minimal rasio kecocokan (opsional).
 
     Returns:
@@ -148,41 +188,37 @@ def compare_palm_features(
     """
     try:
         if threshold is None:
-            threshold = current_app.config.get("PALM_MATCH_THRESHOLD", 0.15)
+            threshold = _match_threshold
 
-        stored_descriptors = deserialize_descriptors(stored_descriptors_json)
+        stored_descriptors = deserialize_descriptors(stored_descriptors)
         if stored_descriptors is None:
             return False, 0.0
 
-        # BFMatcher dengan Hamming distance (cocok untuk ORB)
-        bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=False)
-
         # KNN matching dengan k=2 untuk Lowe's ratio test
         try:
-            matches = bf.knnMatch(input_descriptors, stored_descriptors, k=2)
+            matches = _get_matcher().knnMatch(input_descriptors, stored_descriptors, k=2)
         except cv2.error:
             logger.warning("Gagal melakukan KNN matching")
             return False, 0.0
 
-        # Lowe's ratio test - filter kecocokan yang bagus
-        good_matches = []
-        for match in matches:
-            if len(match) == 2:
-                m, n = match
-                if m.distance < 0.75 * n.distance:
-                    good_matches.append(m)
+        # Lowe's ratio test - hitung kecocokan yang bagus sekaligus dengan NumPy,
+        # hanya jumlahnya yang dipakai sehingga list match tidak perlu dibangun
+        pairs = [match for match in matches if len(match) == 2]
+        nearest = np.fromiter((m.distance for m, _ in pairs), dtype=np.float32, count=len(pairs))
+        second = np.fromiter((n.distance for _, n in pairs), dtype=np.float32, count=len(pairs))
+        good_count = int(np.count_nonzero(nearest < 0.75 * second))
 
         # Hitung skor kecocokan
         total_keypoints = min(len(input_descriptors), len(stored_descriptors))
         if total_keypoints == 0:
             return False, 0.0
 
-        match_score = len(good_matches) / total_keypoints
+        match_score = good_count / total_keypoints
         is_match = match_score >= threshold
 
         logger.debug(
             "Perbandingan palm - good_matches: %d/%d, score: %.4f, threshold: %.4f, cocok: %s",
-            len(good_matches), total_keypoints, match_score, threshold, is_match
+            good_count, total_keypoints, match_score, threshold, is_match
         )
 
         return is_match, match_score
@@ -192,16 +228,25 @@ def compare_palm_features(
         return False, 0.0
 
 
-def serialize_descriptors(descriptors: np.ndarray) -> str:
-    """Mengubah deskriptor ORB menjadi JSON string untuk disimpan di database."""
-    return json.dumps(descriptors.tolist())
+def serialize_descriptors(descriptors: np.ndarray) -> bytes:
+    """Mengubah deskriptor ORB menjadi bytes (header versi + shape, lalu data uint8) untuk disimpan di database."""
+    descriptors = np.ascontiguousarray(descriptors, dtype=np.uint8)
+    rows, cols = descriptors.shape
+    return _DESCRIPTOR_HEADER.pack(_DESCRIPTOR_VERSION, rows, cols) + descriptors.tobytes()
 
 
-def deserialize_descriptors(descriptors_json: str) -> np.ndarray | None:
-    """Mengubah JSON string kembali menjadi numpy array deskriptor."""
+def deserialize_descriptors(buf: bytes) -> np.ndarray | None:
+    """
+    Mengubah bytes dari database kembali menjadi numpy array deskriptor (tanpa copy).
+    Template dengan versi lain mengembalikan None dan harus diregistrasi ulang.
+    """
     try:
-        data = json.loads(descriptors_json)
-        return np.array(data, dtype=np.uint8)
-    except (json.JSONDecodeError, ValueError) as e:
+        version, rows, cols = _DESCRIPTOR_HEADER.unpack_from(buf)
+        if version != _DESCRIPTOR_VERSION or len(buf) != _DESCRIPTOR_HEADER.size + rows * cols:
+            logger.warning("Template palm format lama/tidak dikenal, data palm perlu diregistrasi ulang")
+            return None
+        data = np.frombuffer(buf, dtype=np.uint8, offset=_DESCRIPTOR_HEADER.size)
+        return data.reshape(rows, cols)
+    except (struct.error, ValueError) as e:
         logger.error("Gagal deserialize deskriptor: %s", str(e))
         return None
@@ -0,0 +1,104 @@
+"""
+Vector Search (pgvector)
+=========================
+Pencarian nearest-neighbor embedding wajah langsung di PostgreSQL
+menggunakan ekstensi pgvector (operator cosine distance <=> + index HNSW),
+sehingga hanya kandidat teratas yang dikirim ke aplikasi.
+
+Aktif jika FACE_SEARCH_BACKEND=pgvector. Kolom embedding_vector dan
+index-nya dibuat lewat perintah `flask init-pgvector` (lihat app/cli.py);
+kolom embedding (bytes) tetap menjadi sumber data utama.
+"""
+
+import logging
+import numpy as np
+from flask import current_app
+from sqlalchemy import text
+
+from app.extensions import db
+from app.services.face_service import deserialize_embedding
+
+logger = logging.getLogger(__name__)
+
+# pgvector belum bisa membuat index HNSW untuk vector di atas 2000 dimensi
+_HNSW_MAX_DIM = 2000
+
+
+def is_enabled() -> bool:
+    """Mengecek apakah pencarian wajah memakai pgvector."""
+    return current_app.config.get("FACE_SEARCH_BACKEND", "memory") == "pgvector"
+
+
+def _to_literal(embedding: np.ndarray) -> str:
+    """Mengubah embedding menjadi literal teks vector pgvector, contoh: '[0.1,0.2]'."""
+    return "[" + ",".join(f"{x:.8g}" for x in np.asarray(embedding, dtype=np.float32)) + "]"
+
+
+def store(biometric_id: str, embedding: np.ndarray):
+    """Mengisi kolom embedding_vector untuk record yang sudah di-flush (ikut transaksi aktif)."""
+    db.session.execute(
+        text("UPDATE biometric_data SET embedding_vector = CAST(:v AS vector) WHERE id = :id"),
+        {"v": _to_literal(embedding), "id": biometric_id},
+    )
+
+
+def nearest(embedding: np.ndarray) -> tuple[str | None, float]:
+    """
+    Mencari embedding wajah terdekat lewat index HNSW pgvector.
+
+    Returns:
+        tuple: (ID biometrik terdekat atau None, cosine distance)
+    """
+    row = db.session.execute(
+        text(
+            "SELECT id, embedding_vector <=> CAST(:q AS vector) AS distance "
+            "FROM biometric_data "
+            "WHERE biometric_type = 'face' AND embedding_vector IS NOT NULL "
+            "ORDER BY embedding_vector <=> CAST(:q AS vector) LIMIT 1"
+        ),
+        {"q": _to_literal(embedding)},
+    ).first()
+
+    if row is None:
+        return None, float("inf")
+    return row.id, float(row.distance)
+
+
+def init_schema(dim: int) -> int:
+    """
+    Menyiapkan ekstensi, kolom embedding_vector, dan index HNSW (partial, khusus wajah),
+    lalu mengisi kolom untuk data wajah yang sudah ada.
+
+    Returns:
+        int: Jumlah record yang diisi.
+    """
+    db.session.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+    db.session.execute(
+        text(f"ALTER TABLE biometric_data ADD COLUMN IF NOT EXISTS embedding_vector vector({int(dim)})")
+    )
+
+    rows = db.session.execute(
+        text(
+            "SELECT id, embedding FROM biometric_data "
+            "WHERE biometric_type = 'face' AND embedding_vector IS NULL"
+        )
+    ).all()
+    for record_id, embedding in rows:
+        store(record_id, deserialize_embedding(embedding))
+
+    if dim <= _HNSW_MAX_DIM:
+        db.session.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS ix_biometric_data_face_embedding_hnsw "
+                "ON biometric_data USING hnsw (embedding_vector vector_cosine_ops) "
+                "WHERE biometric_type = 'face'"
+            )
+        )
+    else:
+        logger.warning(
+            "Dimensi embedding %d melebihi batas index HNSW pgvector (%d), pencarian memakai scan",
+            dim, _HNSW_MAX_DIM
+        )
+
+    db.session.commit()
+    return len(rows)
@@ -4,10 +4,19 @@ Authentication Utilities
 Middleware dan fungsi bantuan untuk keamanan.
 """
 
+import hmac
 from functools import wraps
 from flask import request, current_app
 from app.utils.responses import error_response
 
+# Key di app.extensions untuk API key (bytes) yang disiapkan saat aplikasi dibuat
+_API_KEY_EXTENSION = "api_key_bytes"
+
+
+def init_api_key(app):
+    """Meng-encode API_KEY dari konfigurasi sekali saat aplikasi dibuat."""
+    app.extensions[_API_KEY_EXTENSION] = (app.config.get("API_KEY") or "").encode()
+
 
 def require_api_key(f):
     """
@@ -18,8 +27,8 @@ def require_api_key(f):
         # Ambil api key dari header request
         api_key = request.headers.get("x-api-key")
         
-        # Ambil api key yang valid dari konfigurasi server
-        valid_api_key = current_app.config.get("API_KEY")
+        # Ambil api key yang valid (sudah di-encode saat startup, lihat init_api_key)
+        valid_api_key = current_app.extensions[_API_KEY_EXTENSION]
 
         if not valid_api_key:
             # Server belum dikonfigurasi dengan API_KEY
@@ -34,7 +43,9 @@ def require_api_key(f):
                 status_code=401
             )
             
-        if api_key != valid_api_key:
+        # Perbandingan constant-time agar waktu respons tidak membocorkan isi API key.
+        # Dibandingkan sebagai bytes: compare_digest menolak str non-ASCII
+        if not hmac.compare_digest(api_key.encode(), valid_api_key):
             return error_response(
                 message="Unauthorized: Invalid x-api-key", 
                 status_code=401
@@ -0,0 +1,45 @@
+"""
+Download Utilities
+==================
+Helper untuk mengunduh file model ke server jika belum tersedia.
+"""
+
+import os
+import logging
+import tempfile
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Ukuran potongan saat menulis unduhan ke disk
+_CHUNK_SIZE = 1 << 20
+
+
+def download_file_if_not_exists(url: str, path: str):
+    """
+    Mengunduh file dari url ke path jika file belum ada.
+    Isi response di-stream ke disk per potongan 1MB (tidak ditampung utuh di memori)
+    melalui file sementara, sehingga unduhan yang gagal tidak meninggalkan file setengah jadi.
+
+    Raises:
+        requests.RequestException: Jika unduhan gagal.
+    """
+    if os.path.exists(path):
+        return
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    logger.info("Mengunduh %s ...", url)
+    # Nama file sementara unik per pemanggil (antar proses maupun thread)
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path), prefix=f"{os.path.basename(path)}.", suffix=".part"
+    )
+    try:
+        with os.fdopen(fd, "wb") as f, requests.get(url, timeout=30, stream=True) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(_CHUNK_SIZE):
+                f.write(chunk)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    logger.info("File berhasil diunduh dan disimpan di %s", path)
@@ -4,7 +4,23 @@ Utilitas Response API
 Helper functions untuk menghasilkan response JSON yang konsisten.
 """
 
-from flask import jsonify
+import orjson
+from flask import current_app
+
+
+def _json_response(payload: dict, status_code: int):
+    """
+    Menserialisasi payload dengan orjson (satu panggilan C, mendukung numpy
+    array/skalar) menjadi response JSON.
+
+    Returns:
+        tuple: (Response JSON, status_code)
+    """
+    response = current_app.response_class(
+        orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY),
+        mimetype="application/json",
+    )
+    return response, status_code
 
 
 def success_response(data=None, message="Berhasil", status_code=200, meta=None):
@@ -29,7 +45,7 @@ def success_response(data=None, message="Berhasil", status_code=200, meta=None):
     if meta is not None:
         response["meta"] = meta
         
-    return jsonify(response), status_code
+    return _json_response(response, status_code)
 
 
 def error_response(message="Terjadi kesalahan", status_code=400, errors=None):
@@ -50,7 +66,7 @@ def error_response(message="Terjadi kesalahan", status_code=400, errors=None):
     }
     if errors is not None:
         response["errors"] = errors
-    return jsonify(response), status_code
+    return _json_response(response, status_code)
 
 
 def not_found_response(message="Data tidak ditemukan"):
@@ -78,3 +94,18 @@ def created_response(data=None, message="Data berhasil ditambahkan"):
         tuple: (Response JSON, 201)
     """
     return success_response(data=data, message=message, status_code=201)
+
+
+def not_modified_response(etag):
+    """
+    Menghasilkan response 304 Not Modified tanpa body.
+
+    Args:
+        etag: ETag representasi yang masih valid di sisi client.
+
+    Returns:
+        Response: Response kosong dengan status 304.
+    """
+    response = current_app.response_class(status=304)
+    response.set_etag(etag)
+    return response